@@ -0,0 +1,194 @@
+"""
+Shared document handling for the conda package extractors: splitting a concatenated
+export file into documents, pulling out each document's dependency strings, and the
+content-hash parse cache kept between runs.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import yaml  # Requires PyYAML: pip install PyYAML
+from pathlib import Path
+
+# Use libyaml's C-backed safe loader when available; fall back to pure Python.
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+log = logging.getLogger(__name__)
+
+# Event types used to walk a document's YAML event stream without building objects
+COLLECTION_START_EVENTS = (yaml.MappingStartEvent, yaml.SequenceStartEvent)
+COLLECTION_END_EVENTS = (yaml.MappingEndEvent, yaml.SequenceEndEvent)
+SCALAR_RESOLVER = yaml.resolver.Resolver()
+STR_TAG = 'tag:yaml.org,2002:str'
+# Bumped whenever parsing changes what a document yields, so caches from older runs are rebuilt
+PARSE_CACHE_FORMAT = 2
+
+
+def scan_dependencies(chunk: str) -> list | None:
+    """
+    Pulls the top-level conda dependency strings out of a single environment.yml
+    document with a line scanner, skipping the nested pip sub-list.
+    Returns None if the document uses any YAML the scanner doesn't understand,
+    so the caller can fall back to a full YAML parse.
+    """
+    dependencies = []
+    in_deps = False
+    found_deps = False
+    item_indent = None
+    skip_indent = None  # Set while inside the '- pip:' sub-list
+
+    for line in chunk.splitlines():
+        stripped = line.lstrip(' ')
+        if not stripped or stripped.startswith('#'):
+            continue
+        if '\t' in line:
+            return None
+        indent = len(line) - len(stripped)
+
+        if not in_deps:
+            if indent == 0 and stripped.startswith('dependencies:'):
+                if stripped[len('dependencies:'):].strip():
+                    return None  # Flow-style list, e.g. 'dependencies: [a, b]'
+                in_deps = found_deps = True
+            continue
+
+        if skip_indent is not None:
+            if indent > skip_indent:
+                continue
+            skip_indent = None
+
+        if indent == 0 and not stripped.startswith('-'):
+            # Back at a top-level key; the dependencies block is over.
+            in_deps = False
+            continue
+
+        if not (stripped == '-' or stripped.startswith('- ')):
+            return None
+        if item_indent is None:
+            item_indent = indent
+        elif indent != item_indent:
+            return None
+
+        item = stripped[1:].strip()
+        if item == 'pip:':
+            skip_indent = indent
+            continue
+        if not item or item[0] in '\'"{[&*!|>%@`' or ': ' in item or ' #' in item or item.endswith(':'):
+            return None
+        # Like walk_dependencies, only keep items a full load would have turned into strings (not 1.5, ~, true, ...)
+        if SCALAR_RESOLVER.resolve(yaml.ScalarNode, item, (True, False)) == STR_TAG:
+            dependencies.append(item)
+
+    if not found_deps:
+        return None
+    return dependencies
+
+
+def skip_node(event, events) -> None:
+    """Consumes the rest of a YAML node whose first event has already been read."""
+    if not isinstance(event, COLLECTION_START_EVENTS):
+        return
+    depth = 1
+    for event in events:
+        if isinstance(event, COLLECTION_START_EVENTS):
+            depth += 1
+        elif isinstance(event, COLLECTION_END_EVENTS):
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def walk_dependencies(chunk: str) -> list | None:
+    """
+    Walks the YAML event stream of a single document and collects the string items
+    of its top-level 'dependencies' sequence without constructing Python objects for
+    the rest of the document. Nested collections (the pip sub-list) are skipped.
+    Returns None if the document is not a mapping.
+    """
+    events = yaml.parse(chunk, Loader=Loader)
+    for event in events:
+        if isinstance(event, yaml.MappingStartEvent):
+            break
+        if not isinstance(event, (yaml.StreamStartEvent, yaml.DocumentStartEvent)):
+            return None
+    else:
+        return None
+
+    for key in events:
+        if isinstance(key, yaml.MappingEndEvent):
+            return []
+        value = next(events)
+        if not (isinstance(key, yaml.ScalarEvent) and key.value == 'dependencies'):
+            skip_node(key, events)
+            skip_node(value, events)
+            continue
+        if not isinstance(value, yaml.SequenceStartEvent):
+            return []
+
+        dependencies = []
+        for item in events:
+            if isinstance(item, yaml.SequenceEndEvent):
+                return dependencies
+            if isinstance(item, yaml.ScalarEvent):
+                # Only keep items a full load would have turned into strings
+                tag = item.tag if item.tag not in (None, '!') else SCALAR_RESOLVER.resolve(yaml.ScalarNode, item.value, item.implicit)
+                if tag == STR_TAG:
+                    dependencies.append(item.value)
+            else:
+                skip_node(item, events)
+    return []
+
+
+def read_documents(input_file: Path) -> list:
+    """
+    Memory-maps the input file and splits it into environment documents on the
+    '\\nname:' boundary. Documents are decoded straight from zero-copy memoryview
+    slices of the mapping, so no intermediate bytes copy is made per document.
+    """
+    documents = []
+    with open(input_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return documents
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            start = 0
+            while True:
+                end = mm.find(b"\nname:", start)
+                if end == -1:
+                    documents.append(str(view[start:], 'utf-8'))
+                    break
+                documents.append(str(view[start:end], 'utf-8'))
+                start = end + 1  # Keep 'name:' at the start of the next document
+    return [doc for doc in documents if doc]
+
+
+def document_digest(chunk: str) -> bytes:
+    """Returns a short content hash used to recognise documents parsed on a previous run."""
+    return hashlib.blake2b(chunk.encode('utf-8'), digest_size=16).digest()
+
+
+def load_parse_cache(cache_path: Path, ignore_list: frozenset) -> dict:
+    """
+    Loads the document-hash -> parse result cache written by a previous run.
+    The cache is discarded if it was built with a different ignore list or cache format.
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError) as e:
+        log.warning("Ignoring unreadable parse cache '%s'. Error: %s", cache_path, e)
+        return {}
+    if not isinstance(cache, dict) or cache.get('ignore_list') != ignore_list or cache.get('format') != PARSE_CACHE_FORMAT:
+        return {}
+    return cache.get('entries', {})
+
+
+def save_parse_cache(cache_path: Path, ignore_list: frozenset, entries: dict):
+    """Persists the parse results of this run so unchanged documents can be skipped next time."""
+    try:
+        with open(cache_path, 'wb') as f:
+            pickle.dump({'format': PARSE_CACHE_FORMAT, 'ignore_list': ignore_list, 'entries': entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except IOError as e:
+        log.warning("Could not write parse cache '%s'. Error: %s", cache_path, e)
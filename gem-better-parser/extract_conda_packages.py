@@ -1,22 +1,61 @@
 import argparse
+import logging
 import yaml  # Requires PyYAML: pip install PyYAML
-import re
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from conda_env_docs import scan_dependencies, walk_dependencies, read_documents, document_digest, load_parse_cache, save_parse_cache
+
+log = logging.getLogger(__name__)
 
 # --- NEW: A set of common conda packages to ignore ---
 # We can safely ignore these as they are fundamental to almost any
 # Python environment and are guaranteed to be in conda-forge.
-CONDA_IGNORE_LIST = {
+CONDA_IGNORE_LIST = frozenset({
     'python',
     'pip',
     'setuptools',
     'wheel',
     'certifi',
     'ca-certificates'
-}
+})
+
+
+def parse_chunk(doc_number: int, chunk: str) -> tuple[tuple | None, set]:
+    """
+    Parses a single environment document and returns (warning, packages).
+    Runs in a worker process, so any warning is handed back to the caller as logging arguments.
+    """
+    packages = set()
+    try:
+        dependencies = scan_dependencies(chunk)
+        if dependencies is None:
+            # Fall back to walking the YAML events for anything the scanner can't handle
+            dependencies = walk_dependencies(chunk)
+
+            if dependencies is None:
+                return ("Skipping document #%d as it's not a valid environment structure.", doc_number), packages
+        if not dependencies or not isinstance(dependencies, list):
+            return None, packages
+
+        for item in dependencies:
+            if isinstance(item, str):
+                package_name = item.partition('=')[0].strip()
+                
+                # --- MODIFIED: Check against the ignore list ---
+                if package_name and package_name not in CONDA_IGNORE_LIST:
+                    packages.add(package_name)
+            
+            elif isinstance(item, dict):
+                # This intentionally does nothing for the pip section.
+                pass
 
+    except yaml.YAMLError as e:
+        return ("Could not parse a YAML document chunk #%d. Error: %s", doc_number, str(e)), packages
 
-def extract_conda_packages(input_file: Path, output_file: Path):
+    return None, packages
+
+
+def extract_conda_packages(input_file: Path, output_file: Path, jobs: int | None = None):
     """
     Parses a file containing one or more concatenated conda environment.yml exports,
     extracts only the conda package names, and saves a unique, sorted list.
@@ -24,60 +63,64 @@ def extract_conda_packages(input_file: Path, output_file: Path):
     print(f"Reading from input file: {input_file}")
     
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            content = f.read()
+        env_yaml_chunks = read_documents(input_file)
     except FileNotFoundError:
-        print(f"ERROR: Input file not found at '{input_file}'")
+        log.error("Input file not found at '%s'", input_file)
         return
 
     # A set to store unique package names automatically
     unique_conda_packages = set()
 
-    # Split the content by 'name:' which typically starts a new YAML document
-    env_yaml_chunks = filter(None, re.split(r'\n(?=name:)', content))
+    doc_count = len(env_yaml_chunks)
+    doc_numbers = range(1, doc_count + 1)
 
-    doc_count = 0
-    for chunk in env_yaml_chunks:
-        doc_count += 1
-        try:
-            data = yaml.safe_load(chunk)
-            
-            if not isinstance(data, dict):
-                print(f"  Skipping document #{doc_count} as it's not a valid environment structure.")
-                continue
+    # Only documents whose content hash isn't in the cache from a previous run need parsing
+    cache_path = Path(f"{output_file}.cache.pkl")
+    cached = load_parse_cache(cache_path, CONDA_IGNORE_LIST)
+    digests = [document_digest(chunk) for chunk in env_yaml_chunks]
+    pending = [(n, chunk) for n, chunk, digest in zip(doc_numbers, env_yaml_chunks, digests) if digest not in cached]
+    pending_numbers = [n for n, _ in pending]
+    pending_chunks = [chunk for _, chunk in pending]
 
-            dependencies = data.get('dependencies', [])
-            if not dependencies or not isinstance(dependencies, list):
-                continue
+    # Documents are independent, so parse them across worker processes and merge the sets here
+    if jobs == 1 or not pending_chunks:
+        results = list(map(parse_chunk, pending_numbers, pending_chunks))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(parse_chunk, pending_numbers, pending_chunks, chunksize=16))
+    parsed = dict(zip(pending_numbers, results))
 
-            for item in dependencies:
-                if isinstance(item, str):
-                    package_name = item.split('=')[0].strip()
-                    
-                    # --- MODIFIED: Check against the ignore list ---
-                    if package_name and package_name not in CONDA_IGNORE_LIST:
-                        unique_conda_packages.add(package_name)
-                
-                elif isinstance(item, dict):
-                    # This intentionally does nothing for the pip section.
-                    pass
+    entries = {}
+    for doc_number, digest in zip(doc_numbers, digests):
+        if digest in cached:
+            packages = cached[digest]
+        else:
+            warning, packages = parsed[doc_number]
+            if warning:
+                # Documents with problems aren't cached so their warning shows up on every run
+                log.warning(*warning)
+                continue
+            packages = frozenset(packages)
+        entries[digest] = packages
+        unique_conda_packages.update(packages)
 
-        except yaml.YAMLError as e:
-            print(f"  Warning: Could not parse a YAML document chunk #{doc_count}. Error: {e}")
+    save_parse_cache(cache_path, CONDA_IGNORE_LIST, entries)
+    if doc_count > len(pending_chunks):
+        print(f"  Reused cached results for {doc_count - len(pending_chunks)} unchanged documents.")
 
     print(f"\nProcessed {doc_count} environment documents.")
     print(f"Found {len(unique_conda_packages)} unique, non-common conda packages.")
 
     # Sort the final list alphabetically and save to the output file
-    sorted_packages = sorted(list(unique_conda_packages))
+    sorted_packages = sorted(unique_conda_packages)
     
     try:
         with open(output_file, 'w', encoding='utf-8') as f:
-            for package in sorted_packages:
-                f.write(f"{package}\n")
+            # One joined write instead of a write() per package
+            f.write("".join(f"{package}\n" for package in sorted_packages))
         print(f"Successfully wrote unique conda package list to: {output_file}")
     except IOError as e:
-        print(f"ERROR: Could not write to output file '{output_file}'. Error: {e}")
+        log.error("Could not write to output file '%s'. Error: %s", output_file, e)
 
 
 if __name__ == "__main__":
@@ -95,6 +138,16 @@ if __name__ == "__main__":
         default="conda_packages_unique.txt",
         help="Path to save the final list of unique conda packages."
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes used to parse documents. Defaults to the number of CPUs; use 1 to parse serially."
+    )
     args = parser.parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     
-    extract_conda_packages(args.input_file, args.output_file)
+    extract_conda_packages(args.input_file, args.output_file, args.jobs)
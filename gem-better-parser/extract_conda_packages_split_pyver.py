@@ -1,11 +1,16 @@
 import argparse
+import logging
 import yaml  # Requires PyYAML: pip install PyYAML
 import re    # <<< NEW IMPORT
 from pathlib import Path
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from conda_env_docs import scan_dependencies, walk_dependencies, read_documents, document_digest, load_parse_cache, save_parse_cache
+
+log = logging.getLogger(__name__)
 
 # A set of common conda packages to ignore
-CONDA_IGNORE_LIST = {
+CONDA_IGNORE_LIST = frozenset({
     'python',
     'pip',
     'setuptools',
@@ -14,21 +19,61 @@ CONDA_IGNORE_LIST = {
     'ca-certificates',
     'anaconda',
     'conda'
-}
+})
+
+# Compiled once and reused for every document and dependency item
+PACKAGE_NAME_RE = re.compile(r"[a-zA-Z0-9_-]+")
+PYTHON_VERSION_RE = re.compile(r"python\s*=\s*(\d+\.\d+)")
 
 def find_python_version(dependencies: list) -> str | None:
     """Scans dependency list and extracts the major.minor python version."""
     if not dependencies:
         return None
-    py_ver_re = re.compile(r"^python\s*=\s*(\d+\.\d+)")
     for item in dependencies:
         if isinstance(item, str):
-            match = py_ver_re.match(item)
+            match = PYTHON_VERSION_RE.match(item)
             if match:
                 return match.group(1)
     return None
 
-def extract_conda_packages(input_file: Path, output_prefix: str):
+
+def parse_chunk(doc_number: int, chunk: str) -> tuple[tuple | None, str | None, set]:
+    """
+    Parses a single environment document and returns (warning, python_version, packages).
+    Runs in a worker process, so any warning is handed back to the caller as logging arguments.
+    """
+    try:
+        dependencies = scan_dependencies(chunk)
+        if dependencies is None:
+            # Fall back to walking the YAML events for anything the scanner can't handle
+            dependencies = walk_dependencies(chunk)
+
+            if dependencies is None:
+                return ("Skipping document #%d as it's not a valid environment structure.", doc_number), None, set()
+        if not dependencies or not isinstance(dependencies, list):
+            return None, None, set()
+
+        py_version = find_python_version(dependencies)
+        if not py_version:
+            return ("No Python version found in document #%d. Skipping.", doc_number), None, set()
+
+        packages = set()
+        for item in dependencies:
+            if isinstance(item, str):
+                # --- MODIFIED: Use a regular expression for robust name extraction ---
+                # This correctly handles "scikit-learn", "numpy=1.2", and "package[version='>1']"
+                match = PACKAGE_NAME_RE.match(item)
+                if match:
+                    package_name = match.group(0)
+                    if package_name and package_name not in CONDA_IGNORE_LIST:
+                        packages.add(package_name)
+                # --- END OF MODIFICATION ---
+        return None, py_version, packages
+
+    except yaml.YAMLError as e:
+        return ("Could not parse a YAML document chunk #%d. Error: %s", doc_number, str(e)), None, set()
+
+def extract_conda_packages(input_file: Path, output_prefix: str, jobs: int | None = None):
     """
     Parses a file containing conda environment exports, groups packages by Python
     version, and saves a unique, sorted list for each version.
@@ -36,48 +81,50 @@ def extract_conda_packages(input_file: Path, output_prefix: str):
     print(f"Reading from input file: {input_file}")
     
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            content = f.read()
+        env_yaml_chunks = read_documents(input_file)
     except FileNotFoundError:
-        print(f"ERROR: Input file not found at '{input_file}'")
+        log.error("Input file not found at '%s'", input_file)
         return
 
     packages_by_python = defaultdict(set)
 
-    env_yaml_chunks = filter(None, re.split(r'\n(?=name:)', content))
+    doc_count = len(env_yaml_chunks)
+    doc_numbers = range(1, doc_count + 1)
 
-    doc_count = 0
-    for chunk in env_yaml_chunks:
-        doc_count += 1
-        try:
-            data = yaml.safe_load(chunk)
-            
-            if not isinstance(data, dict):
-                print(f"  Skipping document #{doc_count} as it's not a valid environment structure.")
-                continue
+    # Only documents whose content hash isn't in the cache from a previous run need parsing
+    cache_path = Path(f"{output_prefix}.cache.pkl")
+    cached = load_parse_cache(cache_path, CONDA_IGNORE_LIST)
+    digests = [document_digest(chunk) for chunk in env_yaml_chunks]
+    pending = [(n, chunk) for n, chunk, digest in zip(doc_numbers, env_yaml_chunks, digests) if digest not in cached]
+    pending_numbers = [n for n, _ in pending]
+    pending_chunks = [chunk for _, chunk in pending]
 
-            dependencies = data.get('dependencies', [])
-            if not dependencies or not isinstance(dependencies, list):
-                continue
-            
-            py_version = find_python_version(dependencies)
-            if not py_version:
-                print(f"  Warning: No Python version found in document #{doc_count}. Skipping.")
+    # Documents are independent, so parse them across worker processes and merge the sets here
+    if jobs == 1 or not pending_chunks:
+        results = list(map(parse_chunk, pending_numbers, pending_chunks))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(parse_chunk, pending_numbers, pending_chunks, chunksize=16))
+    parsed = dict(zip(pending_numbers, results))
+
+    entries = {}
+    for doc_number, digest in zip(doc_numbers, digests):
+        if digest in cached:
+            py_version, packages = cached[digest]
+        else:
+            warning, py_version, packages = parsed[doc_number]
+            if warning:
+                # Documents with problems aren't cached so their warning shows up on every run
+                log.warning(*warning)
                 continue
+            packages = frozenset(packages)
+        entries[digest] = (py_version, packages)
+        if py_version:
+            packages_by_python[py_version].update(packages)
 
-            for item in dependencies:
-                if isinstance(item, str):
-                    # --- MODIFIED: Use a regular expression for robust name extraction ---
-                    # This correctly handles "scikit-learn", "numpy=1.2", and "package[version='>1']"
-                    match = re.match(r"^[a-zA-Z0-9_-]+", item.strip())
-                    if match:
-                        package_name = match.group(0)
-                        if package_name and package_name not in CONDA_IGNORE_LIST:
-                            packages_by_python[py_version].add(package_name)
-                    # --- END OF MODIFICATION ---
-                            
-        except yaml.YAMLError as e:
-            print(f"  Warning: Could not parse a YAML document chunk #{doc_count}. Error: {e}")
+    save_parse_cache(cache_path, CONDA_IGNORE_LIST, entries)
+    if doc_count > len(pending_chunks):
+        print(f"  Reused cached results for {doc_count - len(pending_chunks)} unchanged documents.")
 
     print(f"\nProcessed {doc_count} environment documents.")
     print(f"Found packages for {len(packages_by_python)} Python versions: {', '.join(sorted(packages_by_python.keys()))}")
@@ -90,15 +137,15 @@ def extract_conda_packages(input_file: Path, output_prefix: str):
         output_filename = Path(output_prefix).name + filename_suffix
         output_path = output_dir / output_filename
         
-        sorted_packages = sorted(list(package_set))
+        sorted_packages = sorted(package_set)
         
         try:
             with open(output_path, 'w', encoding='utf-8') as f:
-                for package in sorted_packages:
-                    f.write(f"{package}\n")
+                # One joined write instead of a write() per package
+                f.write("".join(f"{package}\n" for package in sorted_packages))
             print(f"  -> Successfully wrote {len(sorted_packages)} packages to: {output_path}")
         except IOError as e:
-            print(f"  -> ERROR: Could not write to output file '{output_path}'. Error: {e}")
+            log.error("Could not write to output file '%s'. Error: %s", output_path, e)
 
 
 if __name__ == "__main__":
@@ -115,6 +162,16 @@ if __name__ == "__main__":
         default="conda_packages",
         help="A prefix for the output files. The script will append '_pyVERSION.txt' to this prefix."
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes used to parse documents. Defaults to the number of CPUs; use 1 to parse serially."
+    )
     args = parser.parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     
-    extract_conda_packages(args.input_file, args.output_prefix)
+    extract_conda_packages(args.input_file, args.output_prefix, args.jobs)
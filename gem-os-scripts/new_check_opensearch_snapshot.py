@@ -1,44 +1,503 @@
 import requests
+import urllib3
 import json
+import logging
 import os
 import argparse
 import sys
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-# --- Functions (unchanged - get_snapshot_status_basic_auth) ---
+# orjson is optional; it parses large snapshot responses several times faster than the stdlib
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
-def get_snapshot_status_basic_auth(opensearch_domain_endpoint, snapshot_repository_name, snapshot_id, username, password):
+# ijson is optional; with it the per-index part of a snapshot response is decoded
+# incrementally instead of materializing the whole response at once
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+log = logging.getLogger(__name__)
+
+# Errors that can surface while a streamed response body is being read or decoded:
+# requests wraps some connection failures, urllib3 raises others straight from the raw stream
+STREAM_ERRORS = (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) + ((ijson.JSONError,) if ijson is not None else ())
+
+# Upper bound on snapshot requests in flight at once when checking several snapshots
+MAX_CONCURRENT_FETCHES = 12
+
+# Shared session so repeated calls reuse pooled keep-alive connections instead of
+# paying a fresh TCP + TLS handshake per request. Transient gateway errors are retried
+# with a short backoff on the same pooled connections.
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=MAX_CONCURRENT_FETCHES,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+)
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# (connect, read) timeouts so a hung master node can't stall the script
+REQUEST_TIMEOUT = (3.05, 30)
+
+# Snapshots in these states never change again, so their responses are cached on disk
+TERMINAL_SNAPSHOT_STATES = {"SUCCESS", "FAILED", "PARTIAL"}
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser() / "opensearch-snap"
+
+# Indices requested per call to the paginated _list/indices endpoint
+INDICES_PAGE_SIZE = 100
+# Kept low on purpose: many concurrent status requests put real load on the master node
+MAX_CONCURRENT_PAGE_FETCHES = 8
+# Answers to the first _list/indices request from clusters that don't have the endpoint:
+# 404 or 405 where the route is unknown, 400 where the path is taken for a snapshot name
+PAGING_UNSUPPORTED_STATUSES = {400, 404, 405}
+
+# Multiplier from bytes to MiB (exact, since 1024 * 1024 is a power of two)
+BYTES_TO_MIB = 1.0 / (1024 * 1024)
+
+# Row state for an index listed by name only (the plain get-snapshot form), which carries
+# no shard or size details; such indices are neither pending nor failed
+DETAILS_UNAVAILABLE = "DETAILS_UNAVAILABLE"
+
+# --- Functions ---
+
+def get_cache_path(opensearch_domain_endpoint, snapshot_repository_name, snapshot_id):
+    """Returns the on-disk cache file for a snapshot's status response."""
+    host = urlsplit(opensearch_domain_endpoint).netloc or opensearch_domain_endpoint
+    return CACHE_DIR / f"{host}__{snapshot_repository_name}__{snapshot_id}.json".replace('/', '_')
+
+def save_cached_status(cache_path, content):
+    """Writes a raw status response to the cache, replacing any previous copy atomically."""
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        log.warning("Could not write snapshot cache file '%s': %s", cache_path, e)
+
+def get_snapshot_state(snapshot_data):
+    """Returns the top-level state of the first snapshot in a status response, or None."""
+    try:
+        return snapshot_data['snapshots'][0].get('state')
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+def load_cached_status(cache_path):
+    """Returns the cached status response at cache_path, or None if there isn't a usable one."""
+    try:
+        return json_loads(cache_path.read_bytes())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log.warning("Ignoring unreadable snapshot cache file '%s': %s", cache_path, e)
+        return None
+
+def get_snapshot_status_basic_auth(opensearch_domain_endpoint, snapshot_repository_name, snapshot_id, username, password, refresh=False, offline=False):
     """
     Retrieves the status of a specific OpenSearch snapshot using basic authentication.
+    Responses for snapshots in a terminal state are cached on disk and served from there
+    on later runs, unless refresh is set. With offline set, only the cache is consulted.
     """
+    cache_path = get_cache_path(opensearch_domain_endpoint, snapshot_repository_name, snapshot_id)
+    if not refresh:
+        cached_status = load_cached_status(cache_path)
+        if cached_status is not None:
+            return cached_status
+    if offline:
+        log.error("No cached status for snapshot '%s' and --offline was given.", snapshot_id)
+        return None
+
     snapshot_url = f'{opensearch_domain_endpoint}/_snapshot/{snapshot_repository_name}/{snapshot_id}'
     try:
-        response = requests.get(snapshot_url, auth=(username, password))
+        response = SESSION.get(snapshot_url, auth=(username, password), timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        # Parse the raw bytes directly rather than going through response.json()
+        snapshot_data = json_loads(response.content)
+        if get_snapshot_state(snapshot_data) in TERMINAL_SNAPSHOT_STATES:
+            save_cached_status(cache_path, response.content)
+        return snapshot_data
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching snapshot status: {e}", file=sys.stderr)
-        print(f"Response content: {e.response.text if e.response else 'N/A'}", file=sys.stderr)
+        log.error("Error fetching snapshot status: %s", e)
+        log.error("Response content: %s", e.response.text if e.response else 'N/A')
         return None
+    except ValueError as e:
+        log.error("Error decoding snapshot status response: %s", e)
+        return None
+
+class TeeReader:
+    """File-like wrapper that keeps a copy of everything read, until told to stop."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.chunks = []
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        if self.chunks is not None:
+            self.chunks.append(data)
+        return data
+
+    def stop_copying(self):
+        self.chunks = None
+
+def iter_streamed_indices(events):
+    """
+    Yields (index_name, index_data) pairs from the events of a streamed 'indices' map,
+    starting just after its start_map and returning once the map has been closed, so the
+    caller can go on reading the fields that follow it.
+    """
+    index_name = None
+    builder = None
+    depth = 0
+    for prefix, event, value in events:
+        if builder is None:
+            if event == 'end_map':
+                return
+            # A map_key: the events that follow build that index's details
+            index_name = value
+            builder = ijson.ObjectBuilder()
+            continue
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+        if depth == 0:
+            yield index_name, builder.value
+            builder = None
+
+def stream_snapshot_status(opensearch_domain_endpoint, snapshot_repository_name, snapshot_id, username, password, refresh=False):
+    """
+    Retrieves the status of a snapshot like get_snapshot_status_basic_auth, but decodes the
+    response incrementally with ijson. Returns (snapshot_data, index_pages).
+    When 'indices' is a dictionary of index details, snapshot_data holds the fields that
+    precede it and index_pages lazily yields the details in pages of INDICES_PAGE_SIZE
+    while the rest of the body is read; fields after 'indices' (such as 'state') are added
+    to snapshot_data once the pages are exhausted. When 'indices' is a list of names, the
+    whole response is decoded into snapshot_data and index_pages is None, as it is for
+    cached responses. Failures return (None, None).
+    """
+    cache_path = get_cache_path(opensearch_domain_endpoint, snapshot_repository_name, snapshot_id)
+    if not refresh:
+        cached_status = load_cached_status(cache_path)
+        if cached_status is not None:
+            return cached_status, None
+
+    snapshot_url = f'{opensearch_domain_endpoint}/_snapshot/{snapshot_repository_name}/{snapshot_id}'
+    try:
+        response = SESSION.get(snapshot_url, auth=(username, password), timeout=REQUEST_TIMEOUT, stream=True)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        log.error("Error fetching snapshot status: %s", e)
+        log.error("Response content: %s", e.response.text if e.response else 'N/A')
+        return None, None
+
+    # Keep the raw bytes only for as long as the snapshot may turn out to be cacheable
+    response.raw.decode_content = True
+    reader = TeeReader(response.raw)
+    events = ijson.parse(reader, use_float=True)
+    header = ijson.ObjectBuilder()
+    streaming_indices = False
+    try:
+        for prefix, event, value in events:
+            if prefix == 'snapshots.item.indices' and event == 'start_map':
+                streaming_indices = True
+                break
+            # A list of index names is small, so it is decoded along with everything else
+            header.event(event, value)
+    except STREAM_ERRORS as e:
+        log.error("Error reading snapshot status response: %s", e)
+        response.close()
+        return None, None
+    snapshot_data = header.value
+
+    if not streaming_indices:
+        try:
+            if get_snapshot_state(snapshot_data) in TERMINAL_SNAPSHOT_STATES:
+                reader.read()
+                save_cached_status(cache_path, b''.join(reader.chunks))
+        except STREAM_ERRORS as e:
+            # The response is already decoded; only the cache copy is lost
+            log.warning("Could not cache snapshot status response: %s", e)
+        finally:
+            response.close()
+        return snapshot_data, None
+
+    # 'state' may only follow 'indices'; if so, keep copying until it has been read
+    header_state = get_snapshot_state(snapshot_data)
+    if header_state is not None and header_state not in TERMINAL_SNAPSHOT_STATES:
+        reader.stop_copying()
+
+    def iter_pages():
+        page = {}
+        try:
+            yield None
+            for index_name, index_data in iter_streamed_indices(events):
+                page[index_name] = index_data
+                if len(page) == INDICES_PAGE_SIZE:
+                    yield page
+                    page = {}
+            if page:
+                yield page
+            # Fill in the fields after 'indices'; snapshot_data is updated in place.
+            # The map itself is left out, as it has already been handed out page by page.
+            header.event('start_map', None)
+            header.event('end_map', None)
+            for prefix, event, value in events:
+                header.event(event, value)
+            snapshot_data['snapshots'][0].pop('indices', None)
+            if reader.chunks is not None and get_snapshot_state(snapshot_data) in TERMINAL_SNAPSHOT_STATES:
+                reader.read()
+                save_cached_status(cache_path, b''.join(reader.chunks))
+        except STREAM_ERRORS as e:
+            log.error("Error reading snapshot status response; the index details are incomplete: %s", e)
+        finally:
+            response.close()
+
+    # Start the generator so that closing it unread still releases the connection
+    index_pages = iter_pages()
+    next(index_pages)
+    return snapshot_data, index_pages
+
+def fetch_snapshot_statuses(opensearch_domain_endpoint, snapshot_repository_name, snapshot_ids, username, password, refresh=False, offline=False):
+    """
+    Fetches several snapshots concurrently over the shared session, overlapping the
+    network round trips. Yields (snapshot_id, status, index_pages) tuples in the order
+    requested; index_pages is only set when the response is being streamed with ijson.
+    """
+    if ijson is not None and not offline:
+        def fetch(sid):
+            return stream_snapshot_status(opensearch_domain_endpoint, snapshot_repository_name, sid, username, password, refresh)
+    else:
+        def fetch(sid):
+            return get_snapshot_status_basic_auth(opensearch_domain_endpoint, snapshot_repository_name, sid, username, password, refresh, offline), None
+
+    max_workers = max(1, min(MAX_CONCURRENT_FETCHES, len(snapshot_ids)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for snapshot_id, (status, index_pages) in zip(snapshot_ids, executor.map(fetch, snapshot_ids)):
+            yield snapshot_id, status, index_pages
+
+def get_snapshot_indices_page(opensearch_domain_endpoint, snapshot_repository_name, snapshot_id, username, password, page_from, page_size):
+    """
+    Retrieves one page of per-index details from the paginated _list/indices endpoint.
+    Returns the decoded page, whose 'indices' entry is a dictionary of index details,
+    or None if the page could not be fetched (including clusters too old to have the
+    endpoint, which reject the first request with one of PAGING_UNSUPPORTED_STATUSES).
+    """
+    page_url = f'{opensearch_domain_endpoint}/_snapshot/{snapshot_repository_name}/{snapshot_id}/_list/indices'
+    try:
+        response = SESSION.get(page_url, params={'from': page_from, 'size': page_size},
+                               auth=(username, password), timeout=REQUEST_TIMEOUT)
+        if page_from == 0 and response.status_code in PAGING_UNSUPPORTED_STATUSES:
+            log.info("Cluster does not support paginated index listing (HTTP %s); using the full snapshot response.", response.status_code)
+            return None
+        response.raise_for_status()
+        page = json_loads(response.content)
+    except requests.exceptions.RequestException as e:
+        log.error("Error fetching index page (from=%s) for snapshot '%s': %s", page_from, snapshot_id, e)
+        return None
+    except ValueError as e:
+        log.error("Error decoding index page (from=%s) for snapshot '%s': %s", page_from, snapshot_id, e)
+        return None
+    indices = normalize_indices(page.get('indices', {})) if isinstance(page, dict) else None
+    if indices is None:
+        log.error("Unexpected index page format for snapshot '%s'. Type: %s", snapshot_id, type(page))
+        return None
+    page['indices'] = indices
+    return page
+
+def get_snapshot_index_pages(opensearch_domain_endpoint, snapshot_repository_name, snapshot_id, username, password, page_size=INDICES_PAGE_SIZE):
+    """
+    Returns an iterator over pages of per-index details, or None if the first page
+    can't be fetched, in which case the caller falls back to the full snapshot response.
+    When the first page reports the total number of indices, the remaining pages are
+    fetched concurrently; otherwise they are fetched one after another until a short page.
+    """
+    first_page = get_snapshot_indices_page(opensearch_domain_endpoint, snapshot_repository_name, snapshot_id, username, password, 0, page_size)
+    if first_page is None:
+        return None
+
+    def fetch_page(page_from):
+        return get_snapshot_indices_page(opensearch_domain_endpoint, snapshot_repository_name, snapshot_id, username, password, page_from, page_size)
+
+    def iter_pages_concurrently(total):
+        yield first_page['indices']
+        page_offsets = range(page_size, total, page_size)
+        if not page_offsets:
+            return
+        max_workers = min(MAX_CONCURRENT_PAGE_FETCHES, len(page_offsets))
+        offsets = iter(page_offsets)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # A sliding window of max_workers requests, taken in index order: each page
+            # reported frees a slot for the next offset, so finished pages don't pile up
+            in_flight = deque((page_from, executor.submit(fetch_page, page_from)) for page_from in islice(offsets, max_workers))
+            while in_flight:
+                page_from, future = in_flight.popleft()
+                page = future.result()
+                next_from = next(offsets, None)
+                if next_from is not None:
+                    in_flight.append((next_from, executor.submit(fetch_page, next_from)))
+                if page is None:
+                    log.error("Index page (from=%s) for snapshot '%s' is missing; the summary is incomplete.", page_from, snapshot_id)
+                    continue
+                yield page['indices']
+
+    def iter_pages_sequentially():
+        page = first_page
+        page_from = 0
+        while True:
+            yield page['indices']
+            if len(page['indices']) < page_size:
+                return
+            page_from += page_size
+            page = fetch_page(page_from)
+            if page is None:
+                log.error("Index listing for snapshot '%s' stopped after %d indices; the summary is incomplete.", snapshot_id, page_from)
+                return
+
+    total = first_page.get('total')
+    if isinstance(total, int) and not isinstance(total, bool):
+        return iter_pages_concurrently(total)
+    return iter_pages_sequentially()
+
+def format_millis(millis, note=None):
+    """
+    Formats an epoch-milliseconds timestamp as the raw value followed by its UTC time,
+    e.g. '1700000000000 (2023-11-14T22:13:20+00:00)'. Non-numeric values are returned as-is.
+    """
+    if not isinstance(millis, (int, float)) or isinstance(millis, bool):
+        return millis
+    try:
+        human = datetime.fromtimestamp(millis / 1000, tz=timezone.utc).isoformat(timespec='seconds')
+    except (OverflowError, OSError, ValueError):
+        return millis
+    return f"{millis} ({human}, {note})" if note else f"{millis} ({human})"
+
+# --- Per-index normalization ---
+
+def get_shard_counts(shards_stats):
+    """
+    Returns (total, done, failed) from a 'shards_stats' object, with missing counts as 0,
+    or None if it isn't a dictionary. Shared by the snapshot overview and the index rows
+    so the response shape is checked in one place.
+    """
+    if not isinstance(shards_stats, dict):
+        return None
+    return shards_stats.get('total', 0), shards_stats.get('done', 0), shards_stats.get('failed', 0) # 'done' for successful
+
+def normalize_indices(raw_indices_info):
+    """
+    Returns the 'indices' field as a dictionary of index name to index details, or None if
+    it has an unexpected type. The status API returns a dictionary already; the plain
+    get-snapshot form returns a list of index names, and some versions return a list of
+    objects carrying an 'index' key. Names without details map to an empty dictionary,
+    which iter_index_rows reports as DETAILS_UNAVAILABLE.
+    """
+    if isinstance(raw_indices_info, dict):
+        return raw_indices_info
+    if not isinstance(raw_indices_info, list):
+        return None
+    indices = {}
+    for position, entry in enumerate(raw_indices_info):
+        if isinstance(entry, str):
+            indices[entry] = {}
+        elif isinstance(entry, dict) and isinstance(entry.get('index'), str):
+            indices[entry['index']] = entry
+        else:
+            # Keep it under a placeholder name so iter_index_rows reports and counts it
+            indices[f"<entry {position}>"] = entry
+    return indices
+
+def iter_index_rows(raw_indices_info):
+    """
+    Validates each index entry once and yields a flat
+    (index_name, index_state, shards_total, shards_successful, shards_failed, total_size, total_docs)
+    tuple for the report loop. Malformed entries yield index_state None so they are still counted;
+    entries without any details (names only) yield DETAILS_UNAVAILABLE.
+    Warnings and debug details go to the log.
+    """
+    for index_name, index_data in raw_indices_info.items():
+        log.debug("Processing index '%s'. index_data type: %s", index_name, type(index_data))
+        if not isinstance(index_data, dict):
+            log.warning("Index '%s' data is not a dictionary. Skipping details for this index. Type: %s. Value: %.200s...", index_name, type(index_data), index_data)
+            yield index_name, None, 0, 0, 0, 0, 0
+            continue
+        if not index_data:
+            yield index_name, DETAILS_UNAVAILABLE, 0, 0, 0, 0, "N/A"
+            continue
+
+        # For index state, we often infer SUCCESS if shards are all done.
+        # OpenSearch 1.x / Elasticsearch 7.x snapshot status doesn't always have a top-level 'state' per index.
+        # We can derive it from shards_stats.
+        index_shards_stats = index_data.get('shards_stats', {})
+        shard_counts = get_shard_counts(index_shards_stats)
+        if shard_counts is None:
+            log.warning("Index '%s' 'shards_stats' data is not a dictionary. Skipping detailed shard analysis. Type: %s", index_name, type(index_shards_stats))
+            index_state = "UNKNOWN_SHARDS_INFO"
+            index_shards_total = index_shards_successful = index_shards_failed = 0
+        else:
+            index_shards_total, index_shards_successful, index_shards_failed = shard_counts
+
+            if index_shards_total > 0 and index_shards_successful == index_shards_total and index_shards_failed == 0:
+                index_state = "SUCCESS"
+            elif index_shards_failed > 0:
+                index_state = "FAILED"
+            elif index_shards_total > 0 and index_shards_successful < index_shards_total:
+                index_state = "IN_PROGRESS"
+            else:
+                index_state = "UNKNOWN"
+
+        index_stats = index_data.get('stats', {})
+        log.debug("  Index '%s' stats type: %s", index_name, type(index_stats))
+        if not isinstance(index_stats, dict):
+            log.warning("Index '%s' 'stats' data is not a dictionary. Defaulting to 0. Type: %s. Value: %.200s...", index_name, type(index_stats), index_stats)
+            total_size = 0
+            total_docs = 0
+        else:
+            size_stats = index_stats.get('total')
+            total_size = (size_stats.get('size_in_bytes') if isinstance(size_stats, dict) else None) or 0 # stats.total.size_in_bytes
+            # OpenSearch 1.x / Elasticsearch 7.x snapshot status doesn't typically report number_of_documents here.
+            # This would usually come from a _cat/indices API.
+            total_docs = "N/A" # Default to N/A as it's not in snapshot status
+
+        yield index_name, index_state, index_shards_total, index_shards_successful, index_shards_failed, total_size, total_docs
 
 # --- Simplified and Corrected analyze_snapshot_status function ---
 
-def analyze_snapshot_status(snapshot_data, snapshot_id):
+def analyze_snapshot_status(snapshot_data, snapshot_id, index_pages=None, summary_only=False):
     """
     Analyzes the snapshot data and provides detailed and summary information.
     Specifically handles 'indices' field as a dictionary of index details.
+    If index_pages is given (an iterable of such dictionaries, e.g. from
+    get_snapshot_index_pages), it is used instead of the 'indices' field and each
+    page is reported as soon as it has been processed.
+    With summary_only set, a snapshot in a terminal state stops after the overview.
     """
-    print(f"DEBUG: START analyze_snapshot_status for snapshot ID: {snapshot_id}", flush=True)
+    log.debug("START analyze_snapshot_status for snapshot ID: %s", snapshot_id)
 
     if not isinstance(snapshot_data, dict) or 'snapshots' not in snapshot_data or not snapshot_data['snapshots']:
-        print(f"Error: Invalid snapshot data format. Expected dictionary with 'snapshots' key. Received type: {type(snapshot_data)}", flush=True)
+        log.error("Invalid snapshot data format. Expected dictionary with 'snapshots' key. Received type: %s", type(snapshot_data))
         if isinstance(snapshot_data, str):
-            print(f"Received data (first 200 chars): {snapshot_data[:200]}...", flush=True)
+            log.error("Received data (first 200 chars): %.200s...", snapshot_data)
         return
 
     snapshot_info = snapshot_data['snapshots'][0]
-    print(f"DEBUG: snapshot_info type is {type(snapshot_info)}. Keys: {list(snapshot_info.keys()) if isinstance(snapshot_info, dict) else 'N/A'}", flush=True)
+    log.debug("snapshot_info type is %s. Keys: %s", type(snapshot_info), list(snapshot_info) if isinstance(snapshot_info, dict) else 'N/A')
     if not isinstance(snapshot_info, dict):
-        print(f"Error: 'snapshots' list item is not a dictionary. Received type: {type(snapshot_info)}. Value: {str(snapshot_info)[:200]}...", flush=True)
+        log.error("'snapshots' list item is not a dictionary. Received type: %s. Value: %.200s...", type(snapshot_info), snapshot_info)
         return
 
     state = snapshot_info.get('state', 'UNKNOWN')
@@ -49,130 +508,124 @@ def analyze_snapshot_status(snapshot_data, snapshot_id):
     formatted_end_time = None
     if start_time is not None and end_time is not None:
         actual_end_millis = start_time + end_time
-        # You might want to convert these millis timestamps to human-readable datetime
-        # Example: datetime.datetime.fromtimestamp(actual_end_millis / 1000).strftime('%Y-%m-%d %H:%M:%S')
-        formatted_end_time = f"{actual_end_millis} (calculated)"
+        formatted_end_time = format_millis(actual_end_millis, "calculated")
     else:
         # If 'stats.time_in_millis' is not the snapshot end time, this needs adjustment based on actual API.
         # Often, finished snapshots have a top-level 'end_time_in_millis' directly.
         # Let's check for 'end_time_in_millis' at top level as well.
         top_level_end_time = snapshot_info.get('end_time_in_millis')
         if top_level_end_time:
-            formatted_end_time = top_level_end_time
+            formatted_end_time = format_millis(top_level_end_time)
         elif end_time: # Use time_in_millis if it's the only end-time like field
             formatted_end_time = end_time
 
 
     shards_stats = snapshot_info.get('shards_stats', {}) # Corrected: 'shards_stats' at top level
-    print(f"DEBUG: shards_stats type is {type(shards_stats)}", flush=True)
-    if not isinstance(shards_stats, dict):
-        print(f"Warning: 'shards_stats' data is not a dictionary. Defaulting to 0. Type: {type(shards_stats)}. Value: {str(shards_stats)[:200]}...", flush=True)
-        shards_total = 0
-        shards_successful = 0
-        shards_failed = 0
-    else:
-        shards_total = shards_stats.get('total', 0)
-        shards_successful = shards_stats.get('done', 0) # 'done' for successful in shards_stats
-        shards_failed = shards_stats.get('failed', 0)
-
-    print("\n--- Snapshot Overview ---", flush=True)
-    print(f"Snapshot ID: {snapshot_id}", flush=True)
-    print(f"State: {state}", flush=True)
-    print(f"Start Time: {start_time}", flush=True)
-    print(f"End Time (calculated/actual): {formatted_end_time}", flush=True) # Use the formatted end time
-    print(f"Total Shards: {shards_total}", flush=True)
-    print(f"Successful Shards: {shards_successful}", flush=True)
-    print(f"Failed Shards: {shards_failed}", flush=True)
+    log.debug("shards_stats type is %s", type(shards_stats))
+    shard_counts = get_shard_counts(shards_stats)
+    if shard_counts is None:
+        log.warning("'shards_stats' data is not a dictionary. Defaulting to 0. Type: %s. Value: %.200s...", type(shards_stats), shards_stats)
+        shard_counts = (0, 0, 0)
+    shards_total, shards_successful, shards_failed = shard_counts
+
+    # Report lines are buffered and written out once per page of indices,
+    # starting with the overview, instead of one write per line
+    out = [
+        "\n--- Snapshot Overview ---",
+        f"Snapshot ID: {snapshot_id}",
+        f"State: {state}",
+        f"Start Time: {format_millis(start_time)}",
+        f"End Time (calculated/actual): {formatted_end_time}", # Use the formatted end time
+        f"Total Shards: {shards_total}",
+        f"Successful Shards: {shards_successful}",
+        f"Failed Shards: {shards_failed}",
+    ]
 
     overall_percentage = 0
     if shards_total > 0:
         overall_percentage = (shards_successful / shards_total) * 100
-    print(f"Overall Progress: {overall_percentage:.2f}%", flush=True)
+    out.append(f"Overall Progress: {overall_percentage:.2f}%")
 
-    print("\n--- Index Details ---", flush=True)
-    raw_indices_info = snapshot_info.get('indices', {})
-    print(f"DEBUG: raw_indices_info type is {type(raw_indices_info)}", flush=True)
-    
-    # Based on your Dev Tools output, 'indices' is a dictionary of dictionaries
-    if not isinstance(raw_indices_info, dict):
-        print(f"Error: 'indices' data is not a dictionary as expected for detailed analysis. Type: {type(raw_indices_info)}. Value: {str(raw_indices_info)[:200]}...", flush=True)
-        print("No index details can be processed.", flush=True)
+    if summary_only and state in TERMINAL_SNAPSHOT_STATES:
+        # Finished snapshots don't change, so the per-index pass adds nothing when polling
+        sys.stdout.write("\n".join(out) + "\n")
+        sys.stdout.flush()
         return
 
-    total_indices = len(raw_indices_info)
-    completed_indices = 0
-    failed_indices = 0
+    out.append("\n--- Index Details ---")
+    if index_pages is None:
+        raw_indices_info = snapshot_info.get('indices', {})
+        log.debug("raw_indices_info type is %s", type(raw_indices_info))
 
-    for index_name, index_data in raw_indices_info.items():
-        print(f"DEBUG: Processing index '{index_name}'. index_data type: {type(index_data)}", flush=True)
-        if not isinstance(index_data, dict):
-            print(f"Warning: Index '{index_name}' data is not a dictionary. Skipping details for this index. Type: {type(index_data)}. Value: {str(index_data)[:200]}...", flush=True)
-            # We skip detailed processing for this malformed index, but still count it
-            failed_indices += 1 # Or just count it as 'unparseable'
-            continue
+        # Based on your Dev Tools output, 'indices' is a dictionary of dictionaries
+        indices_info = normalize_indices(raw_indices_info)
+        if indices_info is None:
+            sys.stdout.write("\n".join(out) + "\n")
+            sys.stdout.flush()
+            log.error("'indices' data is neither a dictionary nor a list as expected for detailed analysis. Type: %s. Value: %.200s...", type(raw_indices_info), raw_indices_info)
+            log.error("No index details can be processed.")
+            return
+        index_pages = [indices_info]
 
-        # For index state, we often infer SUCCESS if shards are all done.
-        # OpenSearch 1.x / Elasticsearch 7.x snapshot status doesn't always have a top-level 'state' per index.
-        # We can derive it from shards_stats.
-        index_shards_stats = index_data.get('shards_stats', {})
-        
-        # Check if index_shards_stats is a dictionary before getting keys
-        if not isinstance(index_shards_stats, dict):
-            print(f"Warning: Index '{index_name}' 'shards_stats' data is not a dictionary. Skipping detailed shard analysis. Type: {type(index_shards_stats)}", flush=True)
-            index_state = "UNKNOWN_SHARDS_INFO"
-            index_shards_total = 0
-            index_shards_successful = 0
-            index_shards_failed = 0
-        else:
-            index_shards_total = index_shards_stats.get('total', 0)
-            index_shards_successful = index_shards_stats.get('done', 0) # 'done' for successful
-            index_shards_failed = index_shards_stats.get('failed', 0)
+    total_indices = 0
+    # Tallied per state and reduced once after the loop; None counts malformed entries
+    state_counts = Counter()
 
-            if index_shards_total > 0 and index_shards_successful == index_shards_total and index_shards_failed == 0:
-                index_state = "SUCCESS"
-            elif index_shards_failed > 0:
-                index_state = "FAILED"
-            elif index_shards_total > 0 and index_shards_successful < index_shards_total:
-                index_state = "IN_PROGRESS"
-            else:
-                index_state = "UNKNOWN"
+    for raw_indices_info in index_pages:
+        total_indices += len(raw_indices_info)
 
-        index_stats = index_data.get('stats', {})
-        print(f"DEBUG:   Index '{index_name}' stats type: {type(index_stats)}", flush=True)
-        if not isinstance(index_stats, dict):
-            print(f"Warning: Index '{index_name}' 'stats' data is not a dictionary. Defaulting to 0. Type: {type(index_stats)}. Value: {str(index_stats)[:200]}...", flush=True)
-            total_size = 0
-            total_docs = 0
-        else:
-            total_size = index_stats.get('total', {}).get('size_in_bytes', 0) # stats.total.size_in_bytes
-            # OpenSearch 1.x / Elasticsearch 7.x snapshot status doesn't typically report number_of_documents here.
-            # This would usually come from a _cat/indices API.
-            total_docs = "N/A" # Default to N/A as it's not in snapshot status
+        # Type checks happen once in iter_index_rows; this loop only unpacks the flat rows
+        for index_name, index_state, index_shards_total, index_shards_successful, index_shards_failed, total_size, total_docs in iter_index_rows(raw_indices_info):
+            state_counts[index_state] += 1
+            if index_state is None:
+                # We skip detailed processing for this malformed index, but still count it
+                continue
+            if index_state == DETAILS_UNAVAILABLE:
+                out.append(f"\nIndex: {index_name}")
+                out.append("  Details: not available (the response lists index names only)")
+                continue
+
+            out.append(f"\nIndex: {index_name}")
+            out.append(f"  State: {index_state}")
+            out.append(f"  Shards (Total/Successful/Failed): {index_shards_total}/{index_shards_successful}/{index_shards_failed}")
+            out.append(f"  Total Size: {total_size * BYTES_TO_MIB:.2f} MB")
+            out.append(f"  Total Documents: {total_docs}") # Will be N/A
+
+        if out:
+            sys.stdout.write("\n".join(out) + "\n")
+            sys.stdout.flush()
+            out = []
 
-        print(f"\nIndex: {index_name}", flush=True)
-        print(f"  State: {index_state}", flush=True)
-        print(f"  Shards (Total/Successful/Failed): {index_shards_total}/{index_shards_successful}/{index_shards_failed}", flush=True)
-        print(f"  Total Size: {total_size / (1024*1024):.2f} MB", flush=True)
-        print(f"  Total Documents: {total_docs}", flush=True) # Will be N/A
-
-        if index_state == 'SUCCESS':
-            completed_indices += 1
-        elif index_state == 'FAILED':
-            failed_indices += 1
-
-    print(f"\n--- Summary of Indices ---", flush=True)
-    print(f"Total Indices: {total_indices}", flush=True)
-    print(f"Completed Indices: {completed_indices}", flush=True)
-    print(f"Failed Indices: {failed_indices}", flush=True)
-    print(f"Pending/In-progress Indices: {total_indices - completed_indices - failed_indices}", flush=True)
-
-    if total_indices > 0:
-        indices_completion_percentage = (completed_indices / total_indices) * 100
-        print(f"Indices Completion Percentage: {indices_completion_percentage:.2f}%", flush=True)
+    completed_indices = state_counts['SUCCESS']
+    failed_indices = state_counts['FAILED'] + state_counts[None] # Malformed entries count as failed
+    # Names-only entries say nothing about progress, so they stay out of every count below
+    indices_without_details = state_counts[DETAILS_UNAVAILABLE]
+    indices_with_details = total_indices - indices_without_details
+    out.append("\n--- Summary of Indices ---")
+    # A streamed response can carry the snapshot state after its indices, so it may only be known now
+    final_state = snapshot_info.get('state', 'UNKNOWN')
+    if final_state != state:
+        out.append(f"Snapshot State: {final_state}")
+    out += [
+        f"Total Indices: {total_indices}",
+        f"Completed Indices: {completed_indices}",
+        f"Failed Indices: {failed_indices}",
+        f"Pending/In-progress Indices: {indices_with_details - completed_indices - failed_indices}",
+    ]
+    if indices_without_details:
+        out.append(f"Indices Without Details: {indices_without_details}")
+
+    if indices_with_details > 0:
+        indices_completion_percentage = (completed_indices / indices_with_details) * 100
+        out.append(f"Indices Completion Percentage: {indices_completion_percentage:.2f}%")
+    elif total_indices > 0:
+        out.append("Indices Completion Percentage: N/A (No per-index details in the response)")
     else:
-        print("Indices Completion Percentage: N/A (No indices found)", flush=True)
+        out.append("Indices Completion Percentage: N/A (No indices found)")
 
-    print(f"DEBUG: END analyze_snapshot_status", flush=True)
+    sys.stdout.write("\n".join(out) + "\n")
+    sys.stdout.flush()
+    log.debug("END analyze_snapshot_status")
 
 
 # --- Main Execution (unchanged) ---
@@ -184,30 +637,62 @@ if __name__ == "__main__":
     parser.add_argument('--repository', '-r', type=str, required=True,
                         help='The name of the snapshot repository (e.g., my-snapshot-repo)')
     parser.add_argument('--snapshot-id', '-s', type=str, required=True,
-                        help='The ID of the snapshot to check (e.g., my-daily-snapshot-2023-10-27)')
+                        help='The ID of the snapshot to check (e.g., my-daily-snapshot-2023-10-27). Pass a comma-separated list to check several snapshots concurrently.')
     parser.add_argument('--username', '-u', type=str, default=os.environ.get('OPENSEARCH_USERNAME'),
                         help='OpenSearch master username. Can also be set via OPENSEARCH_USERNAME environment variable.')
     parser.add_argument('--password', '-p', type=str, default=os.environ.get('OPENSEARCH_PASSWORD'),
                         help='OpenSearch master password. Can also be set via OPENSEARCH_PASSWORD environment variable.')
+    parser.add_argument('--debug', action='store_const', dest='log_level', const=logging.DEBUG, default=logging.INFO,
+                        help='Enable debug logging of the snapshot response structure.')
+    parser.add_argument('--summary-only', action='store_true',
+                        help='Only print the overview for snapshots that have already finished (SUCCESS, FAILED or PARTIAL).')
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument('--refresh', action='store_true',
+                            help='Ignore cached responses for completed snapshots and fetch them again.')
+    cache_mode.add_argument('--offline', action='store_true',
+                            help='Only use cached responses for completed snapshots; never contact the cluster.')
 
     args = parser.parse_args()
 
-    if not args.username:
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if not args.username and not args.offline:
         parser.error("OpenSearch username not provided. Use --username or set OPENSEARCH_USERNAME environment variable.")
-    if not args.password:
+    if not args.password and not args.offline:
         parser.error("OpenSearch password not provided. Use --password or set OPENSEARCH_PASSWORD environment variable.")
 
-    print(f"Checking status for snapshot '{args.snapshot_id}' in repository '{args.repository}'...", flush=True)
+    snapshot_ids = [sid.strip() for sid in args.snapshot_id.split(',') if sid.strip()]
+    if not snapshot_ids:
+        parser.error("No snapshot ID provided.")
 
-    snapshot_status = get_snapshot_status_basic_auth(
+    for snapshot_id in snapshot_ids:
+        print(f"Checking status for snapshot '{snapshot_id}' in repository '{args.repository}'...")
+
+    # Fetch all snapshots concurrently; analysis stays sequential and in the order given
+    for snapshot_id, snapshot_status, streamed_index_pages in fetch_snapshot_statuses(
         args.endpoint,
         args.repository,
-        args.snapshot_id,
+        snapshot_ids,
         args.username,
-        args.password
-    )
-
-    if snapshot_status:
-        analyze_snapshot_status(snapshot_status, args.snapshot_id)
-    else:
-        print("Failed to retrieve snapshot status. Please check your parameters and network connectivity.", flush=True)
+        args.password,
+        refresh=args.refresh,
+        offline=args.offline
+    ):
+        if snapshot_status:
+            # Page through the indices where the cluster supports it, so output starts
+            # after the first page and only one page is held in memory at a time.
+            # Otherwise fall back to the streamed response, then to the full one.
+            # Finished snapshots (including every cached one) already carry their indices,
+            # so they never page the cluster.
+            index_pages = None
+            is_terminal = get_snapshot_state(snapshot_status) in TERMINAL_SNAPSHOT_STATES
+            skip_indices = args.summary_only and is_terminal
+            if not args.offline and not is_terminal:
+                index_pages = get_snapshot_index_pages(args.endpoint, args.repository, snapshot_id, args.username, args.password)
+            if index_pages is None and not skip_indices:
+                index_pages = streamed_index_pages
+            elif streamed_index_pages is not None:
+                streamed_index_pages.close()
+            analyze_snapshot_status(snapshot_status, snapshot_id, index_pages, summary_only=args.summary_only)
+        else:
+            log.error("Failed to retrieve status for snapshot '%s'. Please check your parameters and network connectivity.", snapshot_id)
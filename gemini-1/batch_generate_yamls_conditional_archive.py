@@ -6,13 +6,29 @@ import os
 import sys
 import logging
 from pathlib import Path
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import shutil # For shutil.which
+import signal
+import hashlib
+import pickle
+import threading
 
 # --- Configuration & Logging ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Per-thread tag (e.g. "[envname] ") put in front of each message, so interleaved lines from parallel envs stay readable
+log_context = threading.local()
+class EnvTagFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'env_tag'): record.env_tag = getattr(log_context, 'tag', "")
+        return True
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(env_tag)s%(message)s')
+for handler in logging.getLogger().handlers: handler.addFilter(EnvTagFilter())
 log = logging.getLogger(__name__)
 
+# Use libyaml's C-backed safe loader/dumper when available; fall back to pure Python.
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 # --- Filtering Configuration (for fallback method) ---
 FILTER_OUT_PACKAGES = {
     "_libgcc_mutex", "_openmp_mutex", "bzip2", "ca-certificates",
@@ -21,29 +37,139 @@ FILTER_OUT_PACKAGES = {
     "xz", "zlib", "certifi", "setuptools", "pip", "wheel", "six", "zipp",
 }
 HISTORY_LENGTH_THRESHOLD = 50
-BUILD_STRING_RE = re.compile(r"=\w*h[0-9a-f]{7,}|=\w+_\d+$|=main$")
+# Directories never searched for environments
+SKIP_DIRS = frozenset({'.git', '.svn', 'node_modules', '__pycache__', 'pkgs', 'pkgs_dirs', '.cache'})
+# MULTILINE so '$' also anchors at each line end when scanning all dependencies joined together
+BUILD_STRING_RE = re.compile(r"=\w*h[0-9a-f]{7,}|=\w+_\d+$|=main$", re.MULTILINE)
+# The block sequence under 'dependencies:' in a raw env export, one item per line
+HISTORY_DEPS_BLOCK_RE = re.compile(r"^dependencies:[ \t]*\r?\n((?:[ \t]*- [^\n]*\n?)*)", re.MULTILINE)
+PIP_VERSION_RE = re.compile(r"(==|>=|<=|<|>|~=)\s*[\w\.\-\+]+.*")
+PIP_COMMENT_RE = re.compile(r"\s*#.*")
+# Strings the emitter can write unquoted; anything else goes through yaml.dump.
+# ASCII only: PyYAML escapes non-ASCII characters by default (allow_unicode=False)
+PLAIN_SCALAR_RE = re.compile(r"[A-Za-z0-9_][\w.\-+=<>!~*,/@]*", re.ASCII)
+SCALAR_RESOLVER = yaml.resolver.Resolver()
+# Package name ends at the first version operator or space of a conda spec
+PACKAGE_NAME_SPLIT_RE = re.compile(r"[=<>~!\s]")
 
 # --- Helper Functions ---
 winOS = sys.platform == "win32"
-def path2str0(p: Path, win_os: bool = True): s = str(p) if win_os else p.as_posix(); return s
-path2str = partial(path2str0, win_os=winOS)
+# A concrete Path's native string already is its POSIX form off Windows, so no per-call platform branch is needed
+path2str = os.fspath
 
 def run_conda_command(conda_exe_path: str, args_list: list, env_path: Path = None, use_shell: bool = False):
-    # (Implementation identical to previous version)
+    # Returns stdout as raw bytes; libyaml parses UTF-8 bytes directly, so decoding here would be wasted work
     command = [str(conda_exe_path)] + args_list
     if env_path: command.extend(['-p', path2str(env_path)])
     cmd_str_for_log = " ".join(command)
     cmd_exec = cmd_str_for_log if use_shell else command
     log.info(f"  Running: {cmd_str_for_log}")
     try:
-        proc = subprocess.run(cmd_exec, capture_output=True, text=True, check=True, shell=use_shell, timeout=180)
-        log.debug(f"  Command stdout:\n{proc.stdout[:500]}...")
+        proc = subprocess.run(cmd_exec, capture_output=True, check=True, shell=use_shell, timeout=180)
+        log.debug(f"  Command stdout:\n{proc.stdout[:500].decode('utf-8', 'replace')}...")
         return proc.stdout
-    except subprocess.CalledProcessError as e: log.error(f"  ERROR running command: {cmd_str_for_log}\n  Stderr: {e.stderr}"); raise
+    except subprocess.CalledProcessError as e: log.error(f"  ERROR running command: {cmd_str_for_log}\n  Stderr: {e.stderr.decode('utf-8', 'replace')}"); raise
     except FileNotFoundError: log.error(f"  ERROR: Conda executable not found at '{conda_exe_path}'."); raise
     except subprocess.TimeoutExpired: log.error(f"  ERROR: Command timed out: {cmd_str_for_log}"); raise
     except Exception as e: log.error(f"  ERROR running command: {cmd_str_for_log}\n  Exception: {e}"); raise
 
+def env_has_pip(env_path: Path) -> bool:
+    """Returns True if conda-meta records an installed 'pip' package for the environment."""
+    try:
+        with os.scandir(os.path.join(env_path, 'conda-meta')) as it:
+            # Records are named '<name>-<version>-<build>.json', e.g. 'pip-22.0.4-py39h06a4308_0.json'
+            return any(entry.name.startswith('pip-') and entry.name[4:5].isdigit() for entry in it)
+    except OSError:
+        return True # Can't tell; let the export decide
+
+def stop_process(proc: subprocess.Popen):
+    """Kills a conda process (and, on POSIX, its whole session) and reaps it."""
+    if proc.poll() is not None: return
+    try:
+        if winOS: proc.kill()
+        else: os.killpg(proc.pid, signal.SIGKILL)
+    except OSError: pass
+    proc.communicate()
+
+def run_conda_exports(conda_exe_path: str, env_path: Path, use_shell: bool = False, include_nobuild: bool = True):
+    """
+    Runs 'conda env export --from-history --no-builds' and, unless include_nobuild is False,
+    'conda env export --no-builds' for one environment. Both only read the environment's
+    metadata, so they are started at the same time and the environment waits for one conda
+    startup instead of two. Returns (history_output, nobuild_output) as bytes; nobuild_output
+    is None if the second export failed or wasn't run. Raises like run_conda_command if the
+    history export fails.
+    """
+    arg_lists = [['env', 'export', '--from-history', '--no-builds']]
+    if include_nobuild: arg_lists.append(['env', 'export', '--no-builds'])
+    running = []
+    try:
+        for args_list in arg_lists:
+            command = [str(conda_exe_path)] + args_list + ['-p', path2str(env_path)]
+            cmd_str = " ".join(command)
+            log.info(f"  Running: {cmd_str}")
+            try:
+                # Own session so a timeout can take down anything conda spawned as well
+                proc = subprocess.Popen(cmd_str if use_shell else command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        shell=use_shell, start_new_session=not winOS)
+            except FileNotFoundError: log.error(f"  ERROR: Conda executable not found at '{conda_exe_path}'."); raise
+            except Exception as e: log.error(f"  ERROR running command: {cmd_str}\n  Exception: {e}"); raise
+            running.append((cmd_str, proc))
+
+        outputs = []
+        for i, (cmd_str, proc) in enumerate(running):
+            try:
+                stdout, stderr = proc.communicate(timeout=180)
+            except subprocess.TimeoutExpired:
+                log.error(f"  ERROR: Command timed out: {cmd_str}")
+                stop_process(proc)
+                if i == 0: raise
+                outputs.append(None); continue
+            if proc.returncode != 0:
+                log.error(f"  ERROR running command: {cmd_str}\n  Stderr: {stderr.decode('utf-8', 'replace')}")
+                if i == 0: raise subprocess.CalledProcessError(proc.returncode, cmd_str, stdout, stderr)
+                outputs.append(None); continue
+            log.debug(f"  Command stdout:\n{stdout[:500].decode('utf-8', 'replace')}...")
+            outputs.append(stdout)
+    finally:
+        for _, proc in running: stop_process(proc)
+    history_output = outputs[0]
+    nobuild_output = outputs[1] if include_nobuild else None
+    return history_output, nobuild_output
+
+def get_package_name(spec: str) -> str:
+    """Returns the package name from a conda spec such as 'pandas>=1.3' or 'python=3.10'."""
+    return PACKAGE_NAME_SPLIT_RE.split(spec.strip(), 1)[0]
+
+def scan_pip_entries(export_output: bytes) -> list | None:
+    """
+    Pulls the entries of the '- pip:' sub-list out of 'conda env export' output with a
+    line scanner, without building the rest of the document. Returns [] if there is no
+    pip sub-list, or None if the output uses YAML the scanner doesn't understand, so the
+    caller can fall back to a full YAML parse.
+    """
+    try:
+        text = export_output.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    entries = None
+    pip_indent = None
+    for line in text.splitlines():
+        stripped = line.lstrip(' ')
+        if not stripped or stripped.startswith('#'): continue
+        if '\t' in line: return None
+        indent = len(line) - len(stripped)
+        if pip_indent is None:
+            if stripped.rstrip() == '- pip:': pip_indent = indent; entries = []
+            continue
+        if indent <= pip_indent: break # End of the pip sub-list
+        if not stripped.startswith('- '): return None
+        item = stripped[2:].strip()
+        # Quoted, flow-style, tagged or mapping items need the real parser
+        if not item or item[0] in '\'"[{&*!|>' or item.endswith(':') or ': ' in item: return None
+        entries.append(item)
+    return entries if entries is not None else []
+
 def get_pip_deps_from_export(export_yaml_data: dict) -> dict | None:
     # (Implementation identical to previous version)
     pip_deps_section = None
@@ -53,57 +179,172 @@ def get_pip_deps_from_export(export_yaml_data: dict) -> dict | None:
     for item in dependencies:
         if isinstance(item, dict) and "pip" in item: pip_deps_section = item; break
     if pip_deps_section is None or 'pip' not in pip_deps_section or not isinstance(pip_deps_section['pip'], list): return None
-    regex_ver = r"(==|>=|<=|<|>|~=)\s*[\w\.\-\+]+.*"; regex_build = r"\s*#.*"
     cleaned_list = []
     for p in pip_deps_section["pip"]:
         if isinstance(p, str):
-             p_no_build = re.sub(regex_build, "", p).strip()
-             p_cleaned = re.sub(regex_ver, "", p_no_build).strip()
+             p_no_build = PIP_COMMENT_RE.sub("", p).strip()
+             p_cleaned = PIP_VERSION_RE.sub("", p_no_build).strip()
              if p_cleaned: cleaned_list.append(p_cleaned)
         else: log.warning(f"  Skipping non-string pip dependency: {p}")
     if not cleaned_list: return None
     log.debug(f"  Extracted and cleaned pip dependencies: {cleaned_list}")
     return {'pip': cleaned_list}
 
-def parse_conda_list_export(export_output: str) -> list:
-    # (Implementation identical to previous version)
+def parse_conda_list_export(export_output: bytes | str) -> list:
+    # Accepts the raw bytes from run_conda_command as well as text
+    if isinstance(export_output, bytes): export_output = export_output.decode('utf-8', 'replace')
     dependencies = []
-    lines = export_output.strip().splitlines()
-    for line in lines:
+    for line in export_output.splitlines():
         line = line.strip()
-        if not line or line.startswith('#'): continue
-        parts = line.split('=')
-        if len(parts) >= 2:
-            package_name = '='.join(parts[:-2]) if len(parts) > 2 else parts[0]
-            version = parts[-2]
-            dependencies.append(f"{package_name}={version}")
-        elif len(parts) == 1: dependencies.append(parts[0])
+        if not line or line[0] == '#': continue
+        # name=version=build -> [name, version, build]; the build string is dropped
+        parts = line.rsplit('=', 2)
+        if len(parts) >= 2: dependencies.append(f"{parts[0]}={parts[1]}")
+        else: dependencies.append(parts[0])
     return dependencies
 
+def find_history_problem(dependencies: list) -> str | None:
+    """Returns why a history dependency list looks non-minimal, or None if it looks clean."""
+    if len(dependencies) > HISTORY_LENGTH_THRESHOLD:
+        return f"Found {len(dependencies)} dependencies (>= threshold {HISTORY_LENGTH_THRESHOLD})"
+    # One search over all specs instead of one call per dependency
+    joined = "\n".join(dep for dep in dependencies if isinstance(dep, str))
+    match = BUILD_STRING_RE.search(joined)
+    if match:
+        line_start = joined.rfind("\n", 0, match.start()) + 1
+        line_end = joined.find("\n", match.end())
+        dep = joined[line_start:line_end if line_end != -1 else len(joined)]
+        return f"Found build string pattern in '{dep}'"
+    return None
+
+def prescan_history_output(history_output: bytes) -> str | None:
+    """
+    Runs the history quality check on the raw export text, so clearly non-minimal histories skip the YAML parse.
+    Returns the problem found, or None when the text is clean or too unusual to judge without parsing.
+    """
+    match = HISTORY_DEPS_BLOCK_RE.search(history_output.decode('utf-8', 'replace'))
+    if not match: return None
+    dependencies = [line.strip()[1:].strip() for line in match.group(1).splitlines()]
+    # Quoted, commented or mapping entries read differently once parsed; leave those to the full check
+    if any(dep[:1] in ('"', "'") or '#' in dep or dep.endswith(':') for dep in dependencies): return None
+    return find_history_problem(dependencies)
+
 def is_history_output_good(hist_data: dict) -> bool:
-    # (Implementation identical to previous version)
     if not hist_data or 'dependencies' not in hist_data or not isinstance(hist_data['dependencies'], list):
         log.warning("  History data is empty or invalid format for quality check.")
         return False
-    dependencies = hist_data['dependencies']
-    if len(dependencies) > HISTORY_LENGTH_THRESHOLD:
-        log.warning(f"  History check: Found {len(dependencies)} dependencies (>= threshold {HISTORY_LENGTH_THRESHOLD}). Assuming NON-minimal history.")
+    problem = find_history_problem(hist_data['dependencies'])
+    if problem:
+        log.warning(f"  History check: {problem}. Assuming NON-minimal history.")
         return False
-    for dep in dependencies:
-        if isinstance(dep, str) and BUILD_STRING_RE.search(dep):
-            log.warning(f"  History check: Found build string pattern in '{dep}'. Assuming NON-minimal history.")
-            return False
     log.info("  History check: Output appears minimal and clean.")
     return True
 
+def is_plain_scalar(value) -> bool:
+    """True if yaml.dump would write this value as an unquoted string."""
+    return (isinstance(value, str) and PLAIN_SCALAR_RE.fullmatch(value) is not None
+            and SCALAR_RESOLVER.resolve(yaml.ScalarNode, value, (True, False)) == 'tag:yaml.org,2002:str')
+
+def emit_env_yaml(yaml_data: dict) -> str:
+    """
+    Renders the final environment YAML ({'name', 'channels', 'dependencies'} with string
+    specs and an optional {'pip': [...]} entry) directly, matching yaml.dump's block style.
+    Falls back to yaml.dump for any other shape or any value that would need quoting.
+    """
+    name = yaml_data.get('name')
+    channels = yaml_data.get('channels')
+    dependencies = yaml_data.get('dependencies')
+    if list(yaml_data) != ['name', 'channels', 'dependencies'] or not is_plain_scalar(name) \
+            or not isinstance(channels, list) or not isinstance(dependencies, list) \
+            or not channels or not dependencies or not all(is_plain_scalar(c) for c in channels):
+        return yaml.dump(yaml_data, Dumper=Dumper, default_flow_style=False, sort_keys=False)
+    lines = [f"name: {name}", "channels:"]
+    lines.extend(f"- {c}" for c in channels)
+    lines.append("dependencies:")
+    for dep in dependencies:
+        if is_plain_scalar(dep):
+            lines.append(f"- {dep}")
+        elif isinstance(dep, dict) and list(dep) == ['pip'] and isinstance(dep['pip'], list) and dep['pip'] \
+                and all(is_plain_scalar(p) for p in dep['pip']):
+            lines.append("- pip:")
+            lines.extend(f"  - {p}" for p in dep['pip'])
+        else:
+            return yaml.dump(yaml_data, Dumper=Dumper, default_flow_style=False, sort_keys=False)
+    lines.append("")
+    return "\n".join(lines)
+
+# --- Parse cache for history outputs ---
+PARSE_CACHE_FILENAME = ".parse_cache.pkl"
+PARSE_CACHE_VERSION = 1
+_used_parse_digests = set() # History digests seen during this run; only these are saved
+
+def load_parse_cache(cache_path: Path) -> dict:
+    """Loads the history-hash -> parsed history cache written by a previous run."""
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError) as e:
+        log.warning(f"Ignoring unreadable parse cache '{cache_path}'. Error: {e}")
+        return {}
+    if not isinstance(cache, dict) or cache.get('version') != PARSE_CACHE_VERSION:
+        return {}
+    return cache.get('entries', {})
+
+def save_parse_cache(cache_path: Path, entries: dict):
+    """
+    Persists the parsed histories so unchanged environments skip the YAML parse next run.
+    Only histories seen during this run are kept, so entries for changed or removed
+    environments don't pile up in the cache.
+    """
+    entries = {digest: entries[digest] for digest in _used_parse_digests if digest in entries}
+    try:
+        with open(cache_path, 'wb') as f:
+            pickle.dump({'version': PARSE_CACHE_VERSION, 'entries': entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        log.warning(f"Could not write parse cache '{cache_path}'. Error: {e}")
+
+def parse_history_output(history_output: bytes, parse_cache: dict | None):
+    """
+    Parses a history export, reusing the result from parse_cache when the output is unchanged.
+    The returned data may be shared with other environments, so it must be treated as read-only.
+    """
+    if parse_cache is None:
+        return yaml.load(history_output, Loader=Loader)
+    digest = hashlib.blake2b(history_output, digest_size=16).digest()
+    _used_parse_digests.add(digest)
+    if digest in parse_cache:
+        log.debug("  Reusing parsed history from the parse cache.")
+        return parse_cache[digest]
+    hist_data = yaml.load(history_output, Loader=Loader)
+    parse_cache[digest] = hist_data
+    return hist_data
+
+# --- Low-level file writing ---
+WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0) # O_BINARY: no newline translation on Windows
+_created_dirs = set() # Output subdirs already ensured during this run
+
+def write_bytes(filepath: str, content: bytes):
+    """Writes content to filepath with a raw fd, bypassing Python's buffered file objects."""
+    dirpath = os.path.dirname(filepath)
+    if dirpath not in _created_dirs:
+        os.makedirs(dirpath, exist_ok=True)
+        _created_dirs.add(dirpath)
+    fd = os.open(filepath, WRITE_FLAGS, 0o644)
+    try:
+        view = memoryview(content)
+        while view: # A regular file normally takes it all in one write(2)
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
 # --- Function to save raw data ---
-def save_raw_output(output_dir: Path, filename: str, content: str):
-    """Helper to save raw command output."""
+def save_raw_output(output_dir: Path, filename: str, content: bytes):
+    """Helper to save raw command output, byte for byte."""
+    output_filepath = os.path.join(output_dir, filename)
     try:
-        output_filepath = output_dir / filename
-        output_filepath.parent.mkdir(parents=True, exist_ok=True) # Ensure subdir exists
-        with open(output_filepath, 'w') as f:
-            f.write(content)
+        write_bytes(output_filepath, content)
         log.info(f"  Saved raw output: {output_filepath}")
     except Exception as e:
         log.error(f"  ERROR saving raw output {output_filepath}. Error: {e}")
@@ -116,7 +357,9 @@ def process_environment(
     archive_hist_dir: Path,    # Dir for raw history outputs
     archive_list_dir: Path,    # Dir for raw list outputs
     conda_exe: str,
-    use_shell: bool
+    use_shell: bool,
+    parse_cache: dict | None = None, # Shared history-hash -> parsed history cache
+    force: bool = False        # Regenerate even if the final YAML is newer than the env's history
     ):
     """
     Generates the lean YAML, choosing method based on history, and saves raw outputs.
@@ -126,62 +369,82 @@ def process_environment(
     method_used = "unknown"
     safe_filename_base = path2str(env_path).replace(os.path.sep, '_').strip('_') # Base name for files
 
-    # --- Get History Output ---
+    # --- Skip environments unchanged since their YAML was generated ---
+    if not force:
+        try:
+            output_mtime = os.stat(os.path.join(output_dir, f"{safe_filename_base}.yml")).st_mtime
+            history_mtime = os.stat(os.path.join(env_path, 'conda-meta', 'history')).st_mtime
+        except OSError:
+            pass # No previous YAML (or no history file to compare against); process normally
+        else:
+            if output_mtime >= history_mtime:
+                log.info(f"  Up-to-date, skipping {env_path} (use --force to regenerate).")
+                return
+
+    # --- Get History Output (and the --no-builds export, run alongside it) ---
     history_output = None
+    nobuild_output = None
     hist_data = None
+    history_problem = None
+    # Pip dependencies can only be present if pip itself is installed in the environment
+    has_pip = env_has_pip(env_path)
     try:
-        history_output = run_conda_command(
-            conda_exe_path=conda_exe,
-            args_list=['env', 'export', '--from-history', '--no-builds'],
-            env_path=env_path,
-            use_shell=use_shell
-        )
+        history_output, nobuild_output = run_conda_exports(conda_exe, env_path, use_shell, include_nobuild=has_pip)
         # --- ARCHIVE HISTORY OUTPUT ---
         save_raw_output(archive_hist_dir, f"{safe_filename_base}_history.yml", history_output)
         # --- End Archive ---
-        hist_data = yaml.safe_load(history_output) # Parse after saving raw
+        # A history already known to be non-minimal from its raw text is never parsed
+        history_problem = prescan_history_output(history_output)
+        if history_problem is None:
+            hist_data = parse_history_output(history_output, parse_cache) # Parse after saving raw
     except Exception as e:
         log.error(f"  ERROR getting or parsing history for {env_path}. Skipping. Error: {e}")
         return # Cannot proceed without history attempt
 
     # --- Get Pip Deps Separately (using --no-builds only) ---
     pip_section = None
-    try:
-        nobuild_output = run_conda_command(
-            conda_exe_path=conda_exe,
-            args_list=['env', 'export', '--no-builds'],
-            env_path=env_path,
-            use_shell=use_shell
-        )
-        # No need to archive this separately unless desired - pip deps extracted below
-        nobuild_data = yaml.safe_load(nobuild_output)
-        pip_section = get_pip_deps_from_export(nobuild_data)
-    except Exception as e:
-        log.warning(f"  WARNING: Failed to get/process pip deps separately for {env_path}. Proceeding without pip section. Error: {e}")
+    if not has_pip:
+        log.info("  pip is not installed in this environment; skipping the pip dependency export.")
+    else:
+        try:
+            if nobuild_output is None: raise RuntimeError("'conda env export --no-builds' failed.")
+            # No need to archive this separately unless desired - pip deps extracted below
+            # Only the pip sub-list is needed from this export, so skip building the whole document when possible
+            pip_entries = scan_pip_entries(nobuild_output)
+            if pip_entries is None:
+                nobuild_data = yaml.load(nobuild_output, Loader=Loader)
+            else:
+                nobuild_data = {'dependencies': [{'pip': pip_entries}]}
+            pip_section = get_pip_deps_from_export(nobuild_data)
+        except Exception as e:
+            log.warning(f"  WARNING: Failed to get/process pip deps separately for {env_path}. Proceeding without pip section. Error: {e}")
 
     # --- Check History Quality and Decide Method ---
-    if is_history_output_good(hist_data):
+    if history_problem is not None:
+        log.warning(f"  History check: {history_problem}. Assuming NON-minimal history.")
+        history_good = False
+    else:
+        history_good = is_history_output_good(hist_data)
+    if history_good:
         # --- METHOD 1: Process Good History ---
         log.info("  Processing using good history data.")
         method_used = "history"
         try:
             # (Logic identical to previous version for processing good history)
-            original_python_spec = None
             dependencies_from_hist = hist_data.get('dependencies', [])
-            for dep in dependencies_from_hist:
-                 if isinstance(dep, str) and (dep == 'python' or re.match(r"^python\s*(=|<|>|>=|<=|~=)", dep)):
-                     original_python_spec = dep; break
+            # Split each spec into its package name once and reuse it below
+            named_deps = [(get_package_name(d) if isinstance(d, str) else None, d) for d in dependencies_from_hist]
+            # Reversed so the first spec for a name wins
+            name_to_spec = {name: dep for name, dep in reversed(named_deps) if name is not None}
+            original_python_spec = name_to_spec.get('python')
             if not original_python_spec: log.warning(f"  Could not find Python in apparently good history for {env_path}.")
             new_deps = []
             if original_python_spec: new_deps.append(original_python_spec)
-            hist_dep_names = {d.split('=<>')[0].strip() for d in dependencies_from_hist if isinstance(d, str)}
-            if "pip" not in hist_dep_names: new_deps.append("pip")
-            if "setuptools" not in hist_dep_names: new_deps.append("setuptools")
-            if "wheel" not in hist_dep_names: new_deps.append("wheel")
-            for dep in dependencies_from_hist:
+            # Always listed bare; any pinned history entries for them are dropped below
+            new_deps.extend(["pip", "setuptools", "wheel"])
+            for dep_name, dep in named_deps:
                 if isinstance(dep, str):
-                    dep_name = dep.split('=<>')[0].strip()
-                    if dep_name in ['python', 'pip', 'setuptools', 'wheel']: continue
+                    if dep_name in {'python', 'pip', 'setuptools', 'wheel'}: continue
                     new_deps.append(dep)
                 elif isinstance(dep, dict) and 'pip' in dep: continue
                 else: log.warning(f"  Keeping unexpected complex entry from good history: {dep}"); new_deps.append(dep)
@@ -210,17 +473,16 @@ def process_environment(
             if not dependencies_from_list: raise ValueError("Parsed dependency list is empty.")
 
             # (Logic identical to previous version for processing list export)
-            original_python_spec = None
-            for dep in dependencies_from_list:
-                if dep.startswith('python='): original_python_spec = dep; break
+            named_deps = [(get_package_name(d), d) for d in dependencies_from_list]
+            name_to_spec = {name: dep for name, dep in reversed(named_deps)}
+            original_python_spec = name_to_spec.get('python')
             if not original_python_spec: log.warning(f"  Could not find Python in list --export for {env_path}.")
             new_deps = []
             if original_python_spec: new_deps.append(original_python_spec)
             new_deps.extend(["pip", "setuptools", "wheel"])
             kept_count, filtered_count = 0, 0
-            for dep in dependencies_from_list:
-                package_name = dep.split('=')[0].strip()
-                if package_name in ['python', 'pip', 'setuptools', 'wheel']: continue
+            for package_name, dep in named_deps:
+                if package_name in {'python', 'pip', 'setuptools', 'wheel'}: continue
                 if package_name in FILTER_OUT_PACKAGES: filtered_count += 1; log.debug(f"  Filtering out: {dep}")
                 else: new_deps.append(dep); kept_count += 1; log.debug(f"  Keeping dependency: {dep}")
             log.info(f"  Kept {kept_count} packages, filtered out {filtered_count} common dependencies.")
@@ -234,16 +496,21 @@ def process_environment(
 
     # --- Save FINAL Output YAML ---
     if final_yaml_data:
-        output_filepath = Path(output_dir) / f"{safe_filename_base}.yml" # Save in main output dir
+        output_filepath = os.path.join(output_dir, f"{safe_filename_base}.yml") # Save in main output dir
         try:
-            with open(output_filepath, 'w') as f:
-                yaml.dump(final_yaml_data, f, default_flow_style=False, sort_keys=False)
+            # Render in memory and write once instead of streaming many small writes through the file object
+            write_bytes(output_filepath, emit_env_yaml(final_yaml_data).encode('utf-8'))
             log.info(f"  Successfully generated final ({method_used} method): {output_filepath}")
         except Exception as e:
             log.error(f"  ERROR writing final YAML file {output_filepath}. Error: {e}")
     else:
         log.error(f"  No final YAML data generated for {env_path}.")
 
+def process_environment_tagged(tag: str, *args):
+    """Runs process_environment with every log line it emits from this thread prefixed by tag."""
+    log_context.tag = tag
+    try: return process_environment(*args)
+    finally: log_context.tag = ""
 
 # --- find_conda_environments function (Same as before) ---
 def find_conda_environments(search_paths: list) -> list:
@@ -255,17 +522,28 @@ def find_conda_environments(search_paths: list) -> list:
         if not base_path.is_dir():
             log.warning(f"  Search path '{base_path_str}' not found or not a directory. Skipping.")
             continue
-        for root, dirs, files in os.walk(base_path, topdown=True, onerror=lambda err: log.error(f"  Permission error accessing {err.filename} - Skipping subtree.")):
-            if 'conda-meta' in dirs:
+        # Iterative scandir walk: DirEntry.is_dir() reuses the type readdir already returned,
+        # so classifying entries costs no extra stat calls
+        stack = [str(base_path)]
+        while stack:
+            root = stack.pop()
+            try:
+                with os.scandir(root) as it:
+                    dirs = [entry for entry in it if entry.is_dir()]
+            except OSError as err:
+                log.error(f"  Permission error accessing {err.filename} - Skipping subtree.")
+                continue
+            dir_names = {entry.name for entry in dirs}
+            if 'conda-meta' in dir_names:
                 env_path = Path(root)
-                if (env_path / 'conda-meta' / 'history').exists() and not (env_path / 'pkgs').is_dir():
+                if os.path.exists(os.path.join(root, 'conda-meta', 'history')) and 'pkgs' not in dir_names:
                     log.info(f"  Found potential env: {env_path}")
                     env_paths.add(env_path)
-                    dirs[:] = []
                 else:
                      log.debug(f"  Skipping {env_path}, doesn't look like a standard named/prefix env or history missing.")
-                     dirs[:] = []
-            dirs[:] = [d for d in dirs if d not in ['.git', '.svn', 'node_modules', '__pycache__', 'pkgs', 'pkgs_dirs', '.cache']]
+                continue # Never descend into an environment
+            # Like os.walk, list symlinked directories but don't follow them
+            stack.extend(entry.path for entry in dirs if entry.name not in SKIP_DIRS and not entry.is_symlink())
     return list(env_paths)
 
 # --- Main Execution Logic ---
@@ -280,6 +558,8 @@ if __name__ == "__main__":
     parser.add_argument("-o", "--output-dir", default="conda_forge_yamls_conditional", help="Main directory to save generated YAML files and raw archives.")
     parser.add_argument("--conda-exe", default="conda", help="Path to conda executable.")
     parser.add_argument("--use-shell", action='store_true', help="Use shell=True for conda commands (USE WITH CAUTION!).")
+    parser.add_argument("-j", "--jobs", type=int, default=min(8, os.cpu_count() or 1), help="Number of environments processed concurrently; use 1 to process serially.")
+    parser.add_argument("--force", action='store_true', help="Regenerate YAMLs even for environments whose history is older than their existing output YAML.")
     parser.add_argument("-v", "--verbose", action='store_const', dest='log_level', const=logging.DEBUG, default=logging.INFO, help="Enable verbose (DEBUG) logging.")
 
     args = parser.parse_args()
@@ -321,20 +601,35 @@ if __name__ == "__main__":
          log.info("Starting environment processing with conditional logic and archival...")
          success_count = 0
          fail_count = 0
-         for env_path in sorted(found_envs):
-              try:
-                  process_environment( # Main processing function
+         # Each environment spends most of its time waiting on conda subprocesses, so threads suffice
+         max_workers = max(1, args.jobs)
+         parse_cache_path = output_dir_main / PARSE_CACHE_FILENAME
+         parse_cache = load_parse_cache(parse_cache_path)
+         with ThreadPoolExecutor(max_workers=max_workers) as executor:
+              futures = {
+                  executor.submit(
+                      process_environment_tagged, # Main processing function, log lines tagged with the env name
+                      f"[{env_path.name}] " if max_workers > 1 else "",
                       env_path,
                       output_dir_main, # Dir for final YAMLs
                       archive_dir_history, # Dir for history archives
                       archive_dir_list, # Dir for list archives
                       str(conda_exe_path),
-                      args.use_shell
-                  )
-                  success_count += 1
-              except Exception as e:
-                  log.error(f"CRITICAL ERROR processing {env_path}. Error: {e}")
-                  fail_count +=1
+                      args.use_shell,
+                      parse_cache,
+                      args.force
+                  ): env_path
+                  for env_path in sorted(found_envs)
+              }
+              for future in as_completed(futures):
+                  env_path = futures[future]
+                  try:
+                      future.result()
+                      success_count += 1
+                  except Exception as e:
+                      log.error(f"CRITICAL ERROR processing {env_path}. Error: {e}")
+                      fail_count +=1
+         save_parse_cache(parse_cache_path, parse_cache)
          log.info(f"\nBatch processing finished. Successful: {success_count}, Failed: {fail_count}")
     else:
          log.info("No environments found to process.")
@@ -5,24 +5,47 @@ import re
 import os
 import sys
 import logging
+import logging.handlers
 from pathlib import Path
-from functools import partial
+from functools import lru_cache
 import shutil # For shutil.which
 from datetime import datetime
 import csv
+import hashlib
+from operator import itemgetter
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Logging Setup ---
+# Per-thread tag (e.g. "[envname] ") put in front of each message, so interleaved lines from parallel envs stay readable
+log_context = threading.local()
+class EnvTagFilter(logging.Filter):
+    def filter(self, record):
+        # Tag in the thread that logged it; a buffered record may be formatted later from another thread
+        if not hasattr(record, 'env_tag'): record.env_tag = getattr(log_context, 'tag', "")
+        return True
+
 log = logging.getLogger()
 if log.hasHandlers(): log.handlers.clear()
 log.setLevel(logging.INFO)
 log_filename = f"batch_generate_yamls_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
 file_handler = logging.FileHandler(log_filename)
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-log.addHandler(file_handler)
+file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(env_tag)s%(message)s'))
+file_handler.addFilter(EnvTagFilter())
+# File records are buffered and written in batches; ERROR and above flush immediately
+memory_handler = logging.handlers.MemoryHandler(capacity=1000, flushLevel=logging.ERROR, target=file_handler)
+memory_handler.addFilter(EnvTagFilter())
+log.addHandler(memory_handler)
 console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+console_handler.setFormatter(logging.Formatter('%(levelname)s: %(env_tag)s%(message)s'))
+console_handler.addFilter(EnvTagFilter())
 log.addHandler(console_handler)
 
+# Use libyaml's C-backed safe loader/dumper when available; fall back to pure Python.
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 # --- Filtering Configuration ---
 FILTER_OUT_PACKAGES = {
     "_libgcc_mutex", "_openmp_mutex", "bzip2", "ca-certificates",
@@ -32,25 +55,63 @@ FILTER_OUT_PACKAGES = {
 }
 HISTORY_LENGTH_THRESHOLD = 50
 BUILD_STRING_RE = re.compile(r"=\w*h[0-9a-f]{7,}|=\w+_\d+$|=main$")
+PIP_VERSION_RE = re.compile(r"(==|>=|<=|<|>|~=)\s*[\w\.\-\+]+.*")
+PIP_COMMENT_RE = re.compile(r"\s*#.*")
+# Package name ends at the first version operator or space of a conda spec
+PACKAGE_NAME_SPLIT_RE = re.compile(r"[=<>~!\s]")
+CONDA_VERSION_RE = re.compile(r'conda\s+([\d\.]+)')
+# A history line like '# conda version: 4.8.3'; matched on raw bytes, whitespace kept within the line
+HISTORY_CONDA_VERSION_RE = re.compile(rb"^#[^\S\n]+conda version[^\S\n]*:[^\S\n]*([\d\.]+)", re.MULTILINE)
+# Bytes read per step when scanning a history file backwards from its end
+HISTORY_TAIL_CHUNK = 64 * 1024
+# Longest path-derived archive basename kept as is; leaves room for suffixes under the usual 255-byte NAME_MAX
+MAX_READABLE_BASENAME = 200
+# Directories never searched for environments
+SKIP_DIRS = frozenset({'.git', '.svn', 'node_modules', '__pycache__', 'pkgs', 'pkgs_dirs', '.cache'})
 
 # --- Helper Functions ---
-winOS = sys.platform == "win32"
-def path2str0(p: Path, win_os: bool = True): s = str(p) if win_os else p.as_posix(); return s
-path2str = partial(path2str0, win_os=winOS)
+# A concrete Path's native string already is its POSIX form off Windows, so no per-call platform branch is needed
+path2str = os.fspath
 
 def run_conda_command(conda_exe_path: str, args_list: list, env_path: Path = None, use_shell: bool = False):
+    # Returns stdout as raw bytes: libyaml parses UTF-8 bytes directly and the archives store them as-is
     command = [str(conda_exe_path)] + args_list
     if env_path: command.extend(['-p', path2str(env_path)])
     cmd_str_for_log = " ".join(command)
     cmd_exec = cmd_str_for_log if use_shell else command
-    log.info(f"  Running: {cmd_str_for_log}")
+    log.info("  Running: %s", cmd_str_for_log)
     try:
-        proc = subprocess.run(cmd_exec, capture_output=True, text=True, check=True, shell=use_shell, timeout=180)
+        proc = subprocess.run(cmd_exec, capture_output=True, check=True, shell=use_shell, timeout=180)
         return proc.stdout
-    except subprocess.CalledProcessError as e: log.error(f"  ERROR running command: {cmd_str_for_log}\n  Stderr: {e.stderr}"); raise
-    except FileNotFoundError: log.error(f"  ERROR: Conda executable not found at '{conda_exe_path}'."); raise
-    except subprocess.TimeoutExpired: log.error(f"  ERROR: Command timed out: {cmd_str_for_log}"); raise
-    except Exception as e: log.error(f"  ERROR running command: {cmd_str_for_log}\n  Exception: {e}"); raise
+    except subprocess.CalledProcessError as e: log.error("  ERROR running command: %s\n  Stderr: %s", cmd_str_for_log, e.stderr.decode('utf-8', 'replace')); raise
+    except FileNotFoundError: log.error("  ERROR: Conda executable not found at '%s'.", conda_exe_path); raise
+    except subprocess.TimeoutExpired: log.error("  ERROR: Command timed out: %s", cmd_str_for_log); raise
+    except Exception as e: log.error("  ERROR running command: %s\n  Exception: %s", cmd_str_for_log, e); raise
+
+def env_has_pip(env_path: Path) -> bool:
+    """Returns True if conda-meta records an installed 'pip' package for the environment."""
+    try:
+        with os.scandir(os.path.join(env_path, 'conda-meta')) as it:
+            # Records are named '<name>-<version>-<build>.json', e.g. 'pip-22.0.4-py39h06a4308_0.json'
+            return any(entry.name.startswith('pip-') and entry.name[4:5].isdigit() for entry in it)
+    except OSError:
+        return True # Can't tell; let the export decide
+
+@lru_cache(maxsize=None)
+def find_install_conda(install_root: Path) -> str | None:
+    """Returns <install_root>/bin/conda if it exists; probed once per installation rather than once per env."""
+    conda_bin = install_root / "bin" / "conda"
+    return str(conda_bin) if conda_bin.exists() else None
+
+@lru_cache(maxsize=None)
+def get_conda_version(conda_exe_path: str, use_shell: bool = False) -> str | None:
+    """Runs 'conda --version' once per conda executable; every env using the same conda reuses the answer."""
+    version_output = run_conda_command(conda_exe_path, ['--version'], use_shell=use_shell)
+    match = CONDA_VERSION_RE.search(version_output.decode('utf-8', 'replace'))
+    return match.group(1) if match else None
+
+def get_package_name(spec: str) -> str:
+    return PACKAGE_NAME_SPLIT_RE.split(spec, 1)[0].strip()
 
 def get_pip_deps_from_export(export_yaml_data: dict) -> dict | None:
     pip_deps_section = None
@@ -60,27 +121,24 @@ def get_pip_deps_from_export(export_yaml_data: dict) -> dict | None:
     for item in dependencies:
         if isinstance(item, dict) and "pip" in item: pip_deps_section = item; break
     if pip_deps_section is None or 'pip' not in pip_deps_section or not isinstance(pip_deps_section['pip'], list): return None
-    regex_ver = r"(==|>=|<=|<|>|~=)\s*[\w\.\-\+]+.*"; regex_build = r"\s*#.*"
     cleaned_list = []
     for p in pip_deps_section["pip"]:
         if isinstance(p, str):
-            p_no_build = re.sub(regex_build, "", p).strip(); p_cleaned = re.sub(regex_ver, "", p_no_build).strip()
+            p_no_build = PIP_COMMENT_RE.sub("", p).strip(); p_cleaned = PIP_VERSION_RE.sub("", p_no_build).strip()
             if p_cleaned: cleaned_list.append(p_cleaned)
-        else: log.warning(f"  Skipping non-string pip dependency: {p}")
+        else: log.warning("  Skipping non-string pip dependency: %s", p)
     if not cleaned_list: return None
     return {'pip': cleaned_list}
 
-def parse_conda_list_export(export_output: str) -> list:
+def parse_conda_list_export(export_output: bytes | str) -> list:
+    if isinstance(export_output, bytes): export_output = export_output.decode('utf-8', 'replace')
     dependencies = []
-    lines = export_output.strip().splitlines()
-    for line in lines:
+    for line in export_output.splitlines():
         line = line.strip()
-        if not line or line.startswith('#'): continue
-        parts = line.split('=')
-        if len(parts) >= 2:
-            package_name = '='.join(parts[:-2]) if len(parts) > 2 else parts[0]; version = parts[-2]
-            dependencies.append(f"{package_name}={version}")
-        elif len(parts) == 1: dependencies.append(parts[0])
+        if not line or line[0] == '#': continue
+        # name=version=build -> name=version: cut at the last '=' when there are at least two, no split lists
+        last_eq = line.rfind('=')
+        dependencies.append(line[:last_eq] if last_eq > 0 and line.rfind('=', 0, last_eq) >= 0 else line)
     return dependencies
 
 def is_history_output_good(hist_data: dict) -> tuple[bool, str]:
@@ -92,28 +150,77 @@ def is_history_output_good(hist_data: dict) -> tuple[bool, str]:
     for dep in dependencies:
         if not isinstance(dep, str): continue
         if BUILD_STRING_RE.search(dep): return False, f"Found build string in '{dep}'"
-        package_name = dep.split('=')[0].strip()
+        package_name = dep.partition('=')[0].strip() # First token only; no list built
         if package_name in FILTER_OUT_PACKAGES: return False, f"Found low-level package '{package_name}'"
     return True, "Clean"
 
-def save_raw_output(output_dir: Path, filename: str, content: str):
+@lru_cache(maxsize=None)
+def ensure_dir(dir_path: Path):
+    """Creates dir_path once per run; later calls for the same directory are free."""
+    dir_path.mkdir(parents=True, exist_ok=True)
+
+def make_safe_filename_base(env_path: Path) -> str:
+    """
+    Archive basename for an env: its path with separators turned into '_'. Paths too long for a filename
+    become a short blake2b hash of the full path plus the env name, which stays unique and readable.
+    """
+    path_str = path2str(env_path)
+    safe_base = path_str.replace(os.path.sep, '_').strip('_')
+    if len(os.fsencode(safe_base)) <= MAX_READABLE_BASENAME: return safe_base
+    return f"{hashlib.blake2b(os.fsencode(path_str), digest_size=8).hexdigest()}_{env_path.name[:40]}"
+
+def write_raw_output(output_filepath: Path, content: bytes):
     try:
-        output_filepath = output_dir / filename; output_filepath.parent.mkdir(parents=True, exist_ok=True)
-        with open(output_filepath, 'w') as f: f.write(content)
-        log.info(f"  Saved raw output: {output_filepath}")
-    except Exception as e: log.error(f"  ERROR saving raw output {output_filepath}. Error: {e}")
+        ensure_dir(output_filepath.parent)
+        with open(output_filepath, 'wb') as f: f.write(content)
+        log.info("  Saved raw output: %s", output_filepath)
+    except Exception as e: log.error("  ERROR saving raw output %s. Error: %s", output_filepath, e)
+
+# --- Background Archive Writer ---
+# Raw outputs are queued as (path, content, log tag) and written by one thread, so envs don't wait on archive I/O
+archive_queue = queue.Queue()
+archive_thread = None
+
+def archive_worker():
+    while (item := archive_queue.get()) is not None:
+        output_filepath, content, tag = item
+        log_context.tag = tag # Log under the env that queued it
+        write_raw_output(output_filepath, content)
+    log_context.tag = ""
+
+def start_archive_writer():
+    global archive_thread
+    archive_thread = threading.Thread(target=archive_worker, name="archive-writer", daemon=True)
+    archive_thread.start()
+
+def stop_archive_writer():
+    """Waits for every queued raw output to be written, then stops the writer thread."""
+    global archive_thread
+    if archive_thread is None: return
+    archive_queue.put(None); archive_thread.join(); archive_thread = None
+
+def save_raw_output(output_dir: Path, filename: str, content: bytes):
+    output_filepath = output_dir / filename
+    if archive_thread is None: write_raw_output(output_filepath, content) # No writer running; write inline
+    else: archive_queue.put((output_filepath, content, getattr(log_context, 'tag', "")))
 
 def get_latest_mtime_in_dir(dir_path: Path) -> datetime | None:
     latest_mtime = 0
-    try:
-        for root, _, files in os.walk(dir_path):
-            for file in files:
-                try:
-                    filepath = Path(root) / file; mtime = filepath.stat().st_mtime
+    # Plain str paths and DirEntry objects keep the per-file cost to the one stat call
+    stack = [os.fspath(dir_path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink(): stack.append(entry.path) # Like os.walk, don't follow symlinked dirs
+                            continue
+                        mtime = entry.stat().st_mtime
+                    except OSError: continue
                     if mtime > latest_mtime: latest_mtime = mtime
-                except (FileNotFoundError, PermissionError): continue
-    except Exception as e:
-        log.debug(f"Could not scan directory {dir_path} for mtime: {e}"); return None
+        except OSError as e:
+            log.debug("Could not scan directory for mtime: %s", e); continue
     return datetime.fromtimestamp(latest_mtime) if latest_mtime > 0 else None
 
 # <<< NEW FUNCTION from our discussion >>>
@@ -125,48 +232,60 @@ def get_creation_conda_version(history_file_path: Path) -> str | None:
     if not history_file_path.is_file():
         return None
     
-    # Regex to find a line like '# conda version: 4.8.3'
-    version_re = re.compile(r"^#\s+conda version\s*:\s*([\d\.]+)")
-    
     try:
         # We read the file in reverse because the creation command is at the top,
         # but subsequent updates might also log a conda version. We want the latest
         # version found in the history, which is usually most relevant.
-        with open(history_file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()
-        
-        for line in reversed(lines):
-            match = version_re.search(line)
-            if match:
-                # Return the first version we find from the bottom (most recent)
-                return match.group(1)
-                
+        # Only the tail is read, in chunks, so large histories aren't loaded whole.
+        with open(history_file_path, 'rb') as f:
+            end = f.seek(0, os.SEEK_END); carry = b""
+            while end > 0:
+                start = max(0, end - HISTORY_TAIL_CHUNK)
+                f.seek(start); block = f.read(end - start) + carry
+                # Unless the block starts the file, its first line may be cut off; hold it for the next chunk
+                first_nl = block.find(b"\n")
+                line_start = 0 if start == 0 else (first_nl + 1 if first_nl >= 0 else len(block))
+                matches = HISTORY_CONDA_VERSION_RE.findall(block, line_start)
+                if matches:
+                    # Return the last version in the block (most recent)
+                    return matches[-1].decode('ascii')
+                carry = block[:line_start]; end = start
+
     except Exception as e:
-        log.warning(f"  Could not read or parse history file for creation version: {history_file_path}. Error: {e}")
+        log.warning("  Could not read or parse history file for creation version: %s. Error: %s", history_file_path, e)
         
     return None # Return None if no version string was found
 
 def find_conda_environments(search_paths: list) -> list[tuple[Path, datetime | None]]:
     env_data = []
     for base_path_str in search_paths:
-        base_path = Path(base_path_str).resolve(); log.info(f"Searching for environments under: {base_path}")
-        if not base_path.is_dir(): log.warning(f"  Search path '{base_path_str}' not found or not a directory. Skipping."); continue
-        for root, dirs, files in os.walk(base_path, topdown=True, onerror=lambda err: log.error(f"  Permission error accessing {err.filename} - Skipping subtree.")):
-            if 'conda-meta' in dirs:
+        base_path = Path(base_path_str).resolve(); log.info("Searching for environments under: %s", base_path)
+        if not base_path.is_dir(): log.warning("  Search path '%s' not found or not a directory. Skipping.", base_path_str); continue
+        # Iterative scandir walk in os.walk's top-down order; DirEntry.is_dir() uses the type readdir already returned
+        stack = [str(base_path)]
+        while stack:
+            root = stack.pop()
+            try:
+                with os.scandir(root) as it: dirs = [entry for entry in it if entry.is_dir()]
+            except OSError as err:
+                log.error("  Permission error accessing %s - Skipping subtree.", err.filename); continue
+            dir_names = {entry.name for entry in dirs}
+            if 'conda-meta' in dir_names:
                 env_path = Path(root)
-                if (env_path / 'conda-meta' / 'history').exists() and not (env_path / 'pkgs').is_dir():
-                    log.info(f"  Found potential env: {env_path}")
+                if os.path.exists(os.path.join(root, 'conda-meta', 'history')) and 'pkgs' not in dir_names:
+                    log.info("  Found potential env: %s", env_path)
                     last_modified = get_latest_mtime_in_dir(env_path)
                     env_data.append((env_path, last_modified))
-                    dirs[:] = []
                 else:
-                    log.debug(f"  Skipping {env_path}, doesn't look like a standard named/prefix env or history missing."); dirs[:] = []
-            dirs[:] = [d for d in dirs if d not in ['.git', '.svn', 'node_modules', '__pycache__', 'pkgs', 'pkgs_dirs', '.cache']]
+                    log.debug("  Skipping %s, doesn't look like a standard named/prefix env or history missing.", env_path)
+                continue # Never descend into an environment
+            # Like os.walk, list symlinked directories but don't follow them; reversed so the stack pops in listing order
+            stack.extend(entry.path for entry in reversed(dirs) if entry.name not in SKIP_DIRS and not entry.is_symlink())
     return env_data
 
 # --- Main Processing Function ---
 def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall: Path, archive_hist_dir: Path, archive_list_dir: Path, conda_exe: str, use_shell: bool, use_original_name: bool) -> dict:
-    log.info(f"Processing environment: {env_path}")
+    log.info("Processing environment: %s", env_path)
     original_env_name = env_path.name
     # MODIFIED Default result structure
     result = {
@@ -176,7 +295,7 @@ def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall:
         "status": "ERROR", "kept": 0, "filtered": 0, "filtered_list": "",
         "notes": ""
     }
-    safe_filename_base = path2str(env_path).replace(os.path.sep, '_').strip('_')
+    safe_filename_base = make_safe_filename_base(env_path)
 
     # <<< ADDED THIS BLOCK TO GET CREATION CONDA VERSION >>>
     try:
@@ -184,113 +303,119 @@ def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall:
         creation_version = get_creation_conda_version(history_file)
         if creation_version:
             result['creation_conda_version'] = creation_version
-            log.info(f"  Found creation-era Conda Version from history file: {creation_version}")
+            log.info("  Found creation-era Conda Version from history file: %s", creation_version)
         else:
             log.info("  Creation-era Conda Version not found in history file.")
     except Exception as e:
-        log.warning(f"  Failed to determine creation-era conda version: {e}")
+        log.warning("  Failed to determine creation-era conda version: %s", e)
     # <<< END OF NEW BLOCK >>>
 
     # Get CURRENT conda version that is running the script
     try:
-        conda_in_env_path = env_path.parent.parent / "bin" / "conda"
-        if conda_in_env_path.exists():
-            version_output = run_conda_command(str(conda_in_env_path), ['--version'], use_shell=use_shell)
-        else:
-            version_output = run_conda_command(conda_exe, ['--version'], use_shell=use_shell)
-        
-        match = re.search(r'conda\s+([\d\.]+)', version_output)
-        if match:
-            result['conda_version'] = match.group(1)
-            log.info(f"  Found Current Conda Version: {result['conda_version']}")
+        # Envs under <install>/envs/<name> report the version of their own installation's conda
+        current_version = get_conda_version(find_install_conda(env_path.parent.parent) or conda_exe, use_shell)
+        if current_version:
+            result['conda_version'] = current_version
+            log.info("  Found Current Conda Version: %s", result['conda_version'])
     except Exception as e:
-        log.warning(f"  Could not determine current conda version for {env_path}. Error: {e}")
+        log.warning("  Could not determine current conda version for %s. Error: %s", env_path, e)
         # result['conda_version'] remains "Unknown"
 
     try:
         history_output = run_conda_command(conda_exe, ['env', 'export', '--from-history', '--no-builds'], env_path, use_shell)
-        save_raw_output(archive_hist_dir, f"{safe_filename_base}_history.yml", history_output); hist_data = yaml.safe_load(history_output)
+        save_raw_output(archive_hist_dir, f"{safe_filename_base}_history.yml", history_output); hist_data = yaml.load(history_output, Loader=Loader)
     except Exception as e:
-        log.error(f"  ERROR getting or parsing history for {env_path}. Error: {e}"); result['notes'] = f"Failed to get/parse history: {e}"; return result
+        log.error("  ERROR getting or parsing history for %s. Error: %s", env_path, e); result['notes'] = f"Failed to get/parse history: {e}"; return result
 
     pip_section = None; notes_list = []
-    try:
-        nobuild_output = run_conda_command(conda_exe, ['env', 'export', '--no-builds'], env_path, use_shell)
-        nobuild_data = yaml.safe_load(nobuild_output); pip_section = get_pip_deps_from_export(nobuild_data)
-    except Exception as e:
-        log.warning(f"  WARNING: Failed to get/process pip deps separately. Error: {e}"); notes_list.append("Pip processing failed")
+    # The --no-builds export is only used for its pip section, which can't exist without pip in the env
+    if not env_has_pip(env_path):
+        log.info("  pip is not installed in this environment; skipping the pip dependency export.")
+    else:
+        try:
+            nobuild_output = run_conda_command(conda_exe, ['env', 'export', '--no-builds'], env_path, use_shell)
+            nobuild_data = yaml.load(nobuild_output, Loader=Loader); pip_section = get_pip_deps_from_export(nobuild_data)
+        except Exception as e:
+            log.warning("  WARNING: Failed to get/process pip deps separately. Error: %s", e); notes_list.append("Pip processing failed")
 
     history_is_good, reason = is_history_output_good(hist_data)
     final_yaml_data = None
 
     if history_is_good:
         result['method'] = "History"
-        log.info(f"  Processing using good {result['method']} data.")
+        log.info("  Processing using good %s data.", result['method'])
         try:
             final_env_name = original_env_name if use_original_name else f"cf_hist_{original_env_name}"
-            original_python_spec = None; dependencies_from_hist = hist_data.get('dependencies', []); new_deps = []
-            for dep in dependencies_from_hist:
-                if isinstance(dep, str) and (dep == 'python' or re.match(r"^python\s*(=|<|>|>=|<=|~=)", dep)): original_python_spec = dep; break
-            if not original_python_spec: log.warning(f"  Could not find Python in apparently good history for {env_path}.")
-            if original_python_spec: new_deps.append(original_python_spec)
-            hist_dep_names = {d.split('=<>')[0].strip() for d in dependencies_from_hist if isinstance(d, str)}
-            if "pip" not in hist_dep_names: new_deps.append("pip")
-            if "setuptools" not in hist_dep_names: new_deps.append("setuptools")
-            if "wheel" not in hist_dep_names: new_deps.append("wheel")
+            original_python_spec = None; dependencies_from_hist = hist_data.get('dependencies', []); other_deps = []
+            # One pass picks out the Python spec and keeps everything except python/pip/setuptools/wheel
             for dep in dependencies_from_hist:
                 if isinstance(dep, str):
-                    dep_name = dep.split('=<>')[0].strip()
-                    if dep_name in ['python', 'pip', 'setuptools', 'wheel']: continue
-                    new_deps.append(dep)
+                    dep_name = get_package_name(dep)
+                    if dep_name == 'python':
+                        if original_python_spec is None: original_python_spec = dep
+                        continue
+                    if dep_name in ('pip', 'setuptools', 'wheel'): continue
+                    other_deps.append(dep)
                 elif isinstance(dep, dict) and 'pip' in dep: continue
-                else: log.warning(f"  Keeping unexpected complex entry from good history: {dep}"); new_deps.append(dep)
+                else: log.warning("  Keeping unexpected complex entry from good history: %s", dep); other_deps.append(dep)
+            if not original_python_spec: log.warning("  Could not find Python in apparently good history for %s.", env_path)
+            new_deps = [original_python_spec] if original_python_spec else []
+            new_deps.extend(["pip", "setuptools", "wheel"]); new_deps.extend(other_deps)
             if pip_section: new_deps.append(pip_section)
             final_yaml_data = {'name': final_env_name, 'channels': ['conda-forge'], 'dependencies': new_deps}
         except Exception as e:
-            err_msg = f"ERROR processing good history: {e}"; log.error(f"  {err_msg}"); notes_list.append(err_msg)
+            err_msg = f"ERROR processing good history: {e}"; log.error("  %s", err_msg); notes_list.append(err_msg)
     else:
         result['method'] = "Fallback"
-        log.info(f"  Falling back to filtered 'conda list --export' method. Reason: {reason}")
+        log.info("  Falling back to filtered 'conda list --export' method. Reason: %s", reason)
         try:
             list_export_output = run_conda_command(conda_exe, ['list', '--export'], env_path, use_shell)
             save_raw_output(archive_list_dir, f"{safe_filename_base}_list_export.txt", list_export_output)
             dependencies_from_list = parse_conda_list_export(list_export_output)
             if not dependencies_from_list: raise ValueError("Parsed dependency list is empty.")
-            original_python_spec = None
-            for dep in dependencies_from_list:
-                if dep.startswith('python='): original_python_spec = dep; break
-            if not original_python_spec: log.warning(f"  Could not find Python in list --export for {env_path}.")
-            new_deps = []; kept_count, filtered_count = 0, 0; filtered_packages_list = []
-            if original_python_spec: new_deps.append(original_python_spec)
-            new_deps.extend(["pip", "setuptools", "wheel"])
+            original_python_spec = None; kept_deps = []; filtered_packages_list = []
+            # One pass finds the Python spec and partitions the rest into kept and filtered
             for dep in dependencies_from_list:
-                package_name = dep.split('=')[0].strip()
-                if package_name in ['python', 'pip', 'setuptools', 'wheel']: continue
-                if package_name in FILTER_OUT_PACKAGES: filtered_count += 1; filtered_packages_list.append(dep)
-                else: new_deps.append(dep); kept_count += 1
-            if filtered_packages_list: log.info(f"  Filtered out {filtered_count} common dependencies: {', '.join(filtered_packages_list)}")
-            log.info(f"  Summary: Kept {kept_count} packages after filtering.")
+                package_name = dep.partition('=')[0].strip()
+                if package_name == 'python':
+                    if original_python_spec is None: original_python_spec = dep
+                    continue
+                if package_name in ('pip', 'setuptools', 'wheel'): continue
+                if package_name in FILTER_OUT_PACKAGES: filtered_packages_list.append(dep)
+                else: kept_deps.append(dep)
+            if not original_python_spec: log.warning("  Could not find Python in list --export for %s.", env_path)
+            kept_count, filtered_count = len(kept_deps), len(filtered_packages_list)
+            new_deps = [original_python_spec] if original_python_spec else []
+            new_deps.extend(["pip", "setuptools", "wheel"]); new_deps.extend(kept_deps)
+            if filtered_packages_list: log.info("  Filtered out %s common dependencies: %s", filtered_count, ', '.join(filtered_packages_list))
+            log.info("  Summary: Kept %s packages after filtering.", kept_count)
             result.update({'kept': kept_count, 'filtered': filtered_count, 'filtered_list': ", ".join(filtered_packages_list)})
             if kept_count == 0: notes_list.append("Kept 0 packages")
             if pip_section: new_deps.append(pip_section)
             final_env_name = original_env_name if use_original_name else f"cf_filt_{original_env_name}"
             final_yaml_data = {'name': final_env_name, 'channels': ['conda-forge'], 'dependencies': new_deps}
         except Exception as e:
-            err_msg = f"ERROR processing with fallback: {e}"; log.error(f"  {err_msg}"); notes_list.append(err_msg)
+            err_msg = f"ERROR processing with fallback: {e}"; log.error("  %s", err_msg); notes_list.append(err_msg)
 
     if final_yaml_data:
         output_dir = output_dir_hist if history_is_good else output_dir_fall
         output_filepath = output_dir / f"{final_yaml_data['name']}.yml"
         try:
-            with open(output_filepath, 'w') as f: yaml.dump(final_yaml_data, f, default_flow_style=False, sort_keys=False)
-            log.info(f"  Successfully generated final ({result['method']} method): {output_filepath}")
+            with open(output_filepath, 'w') as f: yaml.dump(final_yaml_data, f, Dumper=Dumper, default_flow_style=False, sort_keys=False)
+            log.info("  Successfully generated final (%s method): %s", result['method'], output_filepath)
             result['status'] = "OK"
         except Exception as e:
-            err_msg = f"ERROR writing final YAML: {e}"; log.error(f"  {err_msg}"); notes_list.append(err_msg)
+            err_msg = f"ERROR writing final YAML: {e}"; log.error("  %s", err_msg); notes_list.append(err_msg)
     
     result['notes'] = "; ".join(notes_list)
     return result
 
+def process_environment_tagged(tag: str, *args) -> dict:
+    """Runs process_environment with every log line it emits from this thread prefixed by tag."""
+    log_context.tag = tag
+    try: return process_environment(*args)
+    finally: log_context.tag = ""
+
 # --- Function for Writing CSV ---
 def write_summary_csv(results: list, output_filepath: Path):
     """Writes the collected results to a CSV file."""
@@ -306,15 +431,16 @@ def write_summary_csv(results: list, output_filepath: Path):
         "kept", "filtered", "notes", "filtered_list"
     ]
     
-    log.info(f"Writing summary to CSV file: {output_filepath}")
+    log.info("Writing summary to CSV file: %s", output_filepath)
     try:
         with open(output_filepath, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(results)
+            # Plain csv.writer rows built by one itemgetter call each; every result dict carries all fieldnames
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+            writer.writerows(map(itemgetter(*fieldnames), results))
         log.info("Successfully wrote CSV summary.")
     except Exception as e:
-        log.error(f"Failed to write CSV summary. Error: {e}")
+        log.error("Failed to write CSV summary. Error: %s", e)
 
 
 # --- Main Execution Logic ---
@@ -325,29 +451,31 @@ if __name__ == "__main__":
     parser.add_argument("--conda-exe", default="conda", help="Path to conda executable.")
     parser.add_argument("--use-shell", action='store_true', help="Use shell=True for conda commands (USE WITH CAUTION!).")
     parser.add_argument("-v", "--verbose", action='store_const', dest='log_level', const=logging.DEBUG, default=logging.INFO, help="Enable verbose (DEBUG) logging.")
+    parser.add_argument("-j", "--jobs", type=int, default=min(8, os.cpu_count() or 1), help="Number of environments processed concurrently; use 1 to process serially.")
     parser.add_argument("--use-original-name", action='store_true', help="Use the original environment name in the output YAML instead of prefixing.")
     args = parser.parse_args()
     log.setLevel(args.log_level)
-    log.info(f"All output is being logged to: {log_filename}")
+    log.info("All output is being logged to: %s", log_filename)
 
     output_dir_main = Path(args.output_dir).resolve(); output_dir_history_ok = output_dir_main / "from_history"; output_dir_fallback = output_dir_main / "from_fallback"; archive_dir_history = output_dir_main / "raw_history_outputs"; archive_dir_list = output_dir_main / "raw_list_export_outputs"
     try:
         output_dir_main.mkdir(parents=True, exist_ok=True); output_dir_history_ok.mkdir(parents=True, exist_ok=True); output_dir_fallback.mkdir(parents=True, exist_ok=True); archive_dir_history.mkdir(parents=True, exist_ok=True); archive_dir_list.mkdir(parents=True, exist_ok=True)
-        log.info(f"Main output directory: {output_dir_main}"); log.info(f"  - Clean history YAMLs will be saved in: {output_dir_history_ok}"); log.info(f"  - Fallback method YAMLs will be saved in: {output_dir_fallback}"); log.info(f"Raw history archive: {archive_dir_history}"); log.info(f"Raw list export archive: {archive_dir_list}")
-    except Exception as e: log.critical(f"Failed to create output directories under '{output_dir_main}'. Error: {e}"); sys.exit(1)
+        log.info("Main output directory: %s", output_dir_main); log.info("  - Clean history YAMLs will be saved in: %s", output_dir_history_ok); log.info("  - Fallback method YAMLs will be saved in: %s", output_dir_fallback); log.info("Raw history archive: %s", archive_dir_history); log.info("Raw list export archive: %s", archive_dir_list)
+    except Exception as e: log.critical("Failed to create output directories under '%s'. Error: %s", output_dir_main, e); sys.exit(1)
     
     conda_exe_path_str = args.conda_exe
-    resolved_path = shutil.which(args.conda_exe)
-    if not Path(conda_exe_path_str).is_file() and '/' not in conda_exe_path_str and '\\' not in conda_exe_path_str:
-        if resolved_path: conda_exe_path_str = resolved_path; log.info(f"Found conda executable via PATH: {conda_exe_path_str}")
-        else: log.critical(f"Conda executable '{args.conda_exe}' not found."); sys.exit(1)
-    elif not Path(conda_exe_path_str).is_file(): log.critical(f"Specified conda executable path not found: {conda_exe_path_str}"); sys.exit(1)
-    else: log.info(f"Using specified conda executable: {conda_exe_path_str}")
+    conda_exe_is_file = Path(conda_exe_path_str).is_file()
+    if not conda_exe_is_file and '/' not in conda_exe_path_str and '\\' not in conda_exe_path_str:
+        resolved_path = shutil.which(args.conda_exe) # Only search PATH for a bare command name
+        if resolved_path: conda_exe_path_str = resolved_path; log.info("Found conda executable via PATH: %s", conda_exe_path_str)
+        else: log.critical("Conda executable '%s' not found.", args.conda_exe); sys.exit(1)
+    elif not conda_exe_is_file: log.critical("Specified conda executable path not found: %s", conda_exe_path_str); sys.exit(1)
+    else: log.info("Using specified conda executable: %s", conda_exe_path_str)
     
     log.info("Starting environment discovery...")
     search_paths_str = [str(p) for p in args.search_paths]
     found_envs_data = find_conda_environments(search_paths_str)
-    log.info(f"Discovery finished. Found {len(found_envs_data)} potential environments.")
+    log.info("Discovery finished. Found %s potential environments.", len(found_envs_data))
 
     if found_envs_data:
         log.info("Starting environment processing...")
@@ -355,13 +483,25 @@ if __name__ == "__main__":
 
         found_envs_data.sort(key=lambda x: x[1] if x[1] else datetime.max)
 
-        for env_path, last_modified in found_envs_data:
+        # Each env spends nearly all its time waiting on conda subprocesses, so threads overlap that waiting
+        jobs = max(1, args.jobs)
+        start_archive_writer()
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures = [
+                    executor.submit(process_environment_tagged, f"[{env_path.name}] " if jobs > 1 else "", env_path, output_dir_history_ok, output_dir_fallback, archive_dir_history, archive_dir_list, conda_exe_path_str, args.use_shell, args.use_original_name)
+                    for env_path, _ in found_envs_data
+                ]
+        finally:
+            stop_archive_writer() # All raw archives are on disk before the summary is written
+        # Collect in submission order so the summary and CSV keep the oldest-first ordering
+        for (env_path, last_modified), future in zip(found_envs_data, futures):
             try:
-                result_dict = process_environment(env_path, output_dir_history_ok, output_dir_fallback, archive_dir_history, archive_dir_list, conda_exe_path_str, args.use_shell, args.use_original_name)
+                result_dict = future.result()
                 result_dict['last_modified'] = last_modified.strftime('%Y-%m-%d') if last_modified else "Unknown"
                 all_results.append(result_dict)
             except Exception as e:
-                log.error(f"CRITICAL ERROR processing {env_path}. Error: {e}")
+                log.error("CRITICAL ERROR processing %s. Error: %s", env_path, e)
                 all_results.append({
                     "env_name": env_path.name, "env_path": str(env_path), "last_modified": last_modified.strftime('%Y-%m-%d') if last_modified else "Unknown",
                     "creation_conda_version": "Unknown", "conda_version": "Unknown",
@@ -374,23 +514,24 @@ if __name__ == "__main__":
 
         log.info("\n\n" + "="*80); log.info("FINAL PROCESSING SUMMARY"); log.info("="*80)
         total_envs = len(all_results); ok_count = sum(1 for r in all_results if r['status'] == "OK"); fallback_count = sum(1 for r in all_results if r['method'] == "Fallback"); history_ok_count = sum(1 for r in all_results if r['method'] == "History"); error_count = total_envs - ok_count
-        log.info(f"Total Environments Processed: {total_envs}"); log.info(f"  Successfully Generated: {ok_count}"); log.info(f"  Errors / Not Generated: {error_count}"); log.info(f"  --- Breakdown of Successes ---"); log.info(f"    Processed via Clean History: {history_ok_count}"); log.info(f"    Processed via Fallback Method: {fallback_count}"); log.info(f"  Summary CSV created at: {csv_path}"); log.info("-"*80)
+        log.info("Total Environments Processed: %s", total_envs); log.info("  Successfully Generated: %s", ok_count); log.info("  Errors / Not Generated: %s", error_count); log.info(f"  --- Breakdown of Successes ---"); log.info("    Processed via Clean History: %s", history_ok_count); log.info("    Processed via Fallback Method: %s", fallback_count); log.info("  Summary CSV created at: %s", csv_path); log.info("-"*80)
         
         log.info("Breakdown by Environment (Oldest first):")
         for r in all_results:
             notes_str = f" | Notes: {r['notes']}" if r['notes'] else ""
             status_str = f"Status: {r['status']} ({r['method']})"
-            log.info(f"  - Env: {r['env_path']}")
+            log.info("  - Env: %s", r['env_path'])
             # MODIFIED line below
-            log.info(f"    - Last Mod: {r['last_modified']:<12} | Creation Conda: {r['creation_conda_version']:<10} | Current Conda: {r['conda_version']:<10} | {status_str}{notes_str}")
+            log.info("    - Last Mod: %-12s | Creation Conda: %-10s | Current Conda: %-10s | %s%s", r['last_modified'], r['creation_conda_version'], r['conda_version'], status_str, notes_str)
         
         if error_count > 0:
             log.info("\n--- Environments with Errors ---")
             for r in all_results:
                 if r['status'] != "OK":
-                    log.info(f"  - Env: {r['env_path']} | Status: {r['status']} | Details: {r['notes']}")
+                    log.info("  - Env: %s | Status: %s | Details: %s", r['env_path'], r['status'], r['notes'])
         log.info("="*80)
     else:
         log.info("No environments found to process.")
 
-    log.info(f"Script finished. Full log available in: {log_filename}")
+    log.info("Script finished. Full log available in: %s", log_filename)
+    memory_handler.flush()
@@ -6,53 +6,86 @@ import os
 import sys
 import logging
 from pathlib import Path
-from functools import partial
 import shutil # For shutil.which
 from datetime import datetime
+from functools import lru_cache
 import csv # <<< NEW IMPORT
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Logging Setup ---
+# Per-thread tag (e.g. "[envname] ") put in front of each message, so interleaved lines from parallel envs stay readable
+log_context = threading.local()
+class EnvTagFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'env_tag'): record.env_tag = getattr(log_context, 'tag', "")
+        return True
+
 log = logging.getLogger()
 if log.hasHandlers(): log.handlers.clear()
 log.setLevel(logging.INFO)
 log_filename = f"batch_generate_yamls_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
 file_handler = logging.FileHandler(log_filename)
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(env_tag)s%(message)s'))
+file_handler.addFilter(EnvTagFilter())
 log.addHandler(file_handler)
 console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+console_handler.setFormatter(logging.Formatter('%(levelname)s: %(env_tag)s%(message)s'))
+console_handler.addFilter(EnvTagFilter())
 log.addHandler(console_handler)
 
 # --- Filtering Configuration ---
-FILTER_OUT_PACKAGES = {
+FILTER_OUT_PACKAGES = frozenset({
     "_libgcc_mutex", "_openmp_mutex", "bzip2", "ca-certificates",
     "ld_impl_linux-64", "libffi", "libgcc-ng", "libgomp", "libstdcxx-ng",
     "libuuid", "ncurses", "openssl", "readline", "sqlite", "tk", "tzdata",
     "xz", "zlib", "certifi", "setuptools", "pip", "wheel", "six", "zipp",
-}
+})
+# Always listed explicitly at the top of the generated dependencies, so skipped when copying the rest
+BASE_PACKAGES = frozenset({'python', 'pip', 'setuptools', 'wheel'})
 HISTORY_LENGTH_THRESHOLD = 50
 BUILD_STRING_RE = re.compile(r"=\w*h[0-9a-f]{7,}|=\w+_\d+$|=main$")
+PIP_VERSION_RE = re.compile(r"(==|>=|<=|<|>|~=)\s*[\w\.\-\+]+.*")
+PIP_COMMENT_RE = re.compile(r"\s*#.*")
+PYTHON_SPEC_RE = re.compile(r"^python\s*(=|<|>|>=|<=|~=)")
+# Splits a spec like 'numpy>=1.21' at its first operator/whitespace; the part before is the package name
+PACKAGE_NAME_SPLIT_RE = re.compile(r"[=<>~!\s]")
+# 'conda x.y.z' as printed by 'conda --version'
+CONDA_VERSION_RE = re.compile(rb'conda\s+([\d\.]+)')
+SKIP_DIRS = frozenset({'.git', '.svn', 'node_modules', '__pycache__', 'pkgs', 'pkgs_dirs', '.cache'})
+# libyaml-backed emitter when PyYAML was built with it, pure-Python otherwise.
+class Dumper(getattr(yaml, "CSafeDumper", yaml.SafeDumper)):
+    """Safe dumper whose dicts are emitted straight from their items in insertion order."""
+# Registered on the subclass once, so the stock dumper classes are left untouched
+Dumper.add_representer(dict, lambda dumper, data: dumper.represent_mapping('tag:yaml.org,2002:map', data.items()))
 
 # --- Helper Functions ---
 # (All helper functions remain the same)
-winOS = sys.platform == "win32"
-def path2str0(p: Path, win_os: bool = True): s = str(p) if win_os else p.as_posix(); return s
-path2str = partial(path2str0, win_os=winOS)
+path2str = os.fspath # Path -> native path string; no wrapper dispatch per call
 
 def run_conda_command(conda_exe_path: str, args_list: list, env_path: Path = None, use_shell: bool = False):
-    command = [str(conda_exe_path)] + args_list
+    # Returns stdout as raw bytes: PyYAML parses UTF-8 bytes directly and the archives store them as-is
+    command = [conda_exe_path, *args_list] # callers pass the exe already as a str
     if env_path: command.extend(['-p', path2str(env_path)])
     cmd_str_for_log = " ".join(command)
     cmd_exec = cmd_str_for_log if use_shell else command
     log.info(f"  Running: {cmd_str_for_log}")
     try:
-        proc = subprocess.run(cmd_exec, capture_output=True, text=True, check=True, shell=use_shell, timeout=180)
+        proc = subprocess.run(cmd_exec, capture_output=True, check=True, shell=use_shell, timeout=180)
         return proc.stdout
-    except subprocess.CalledProcessError as e: log.error(f"  ERROR running command: {cmd_str_for_log}\n  Stderr: {e.stderr}"); raise
+    except subprocess.CalledProcessError as e: log.error(f"  ERROR running command: {cmd_str_for_log}\n  Stderr: {e.stderr.decode('utf-8', 'replace')}"); raise
     except FileNotFoundError: log.error(f"  ERROR: Conda executable not found at '{conda_exe_path}'."); raise
     except subprocess.TimeoutExpired: log.error(f"  ERROR: Command timed out: {cmd_str_for_log}"); raise
     except Exception as e: log.error(f"  ERROR running command: {cmd_str_for_log}\n  Exception: {e}"); raise
 
+@lru_cache(maxsize=None)
+def get_current_conda_version(conda_exe_path: str, use_shell: bool = False) -> str | None:
+    """Runs 'conda --version' once per conda executable; every env managed by the same conda reuses the answer."""
+    version_output = run_conda_command(conda_exe_path, ['--version'], use_shell=use_shell)
+    match = CONDA_VERSION_RE.search(version_output)
+    return match.group(1).decode('ascii') if match else None
+
 def get_pip_deps_from_export(export_yaml_data: dict) -> dict | None:
     # ... (function remains the same)
     pip_deps_section = None
@@ -62,29 +95,42 @@ def get_pip_deps_from_export(export_yaml_data: dict) -> dict | None:
     for item in dependencies:
         if isinstance(item, dict) and "pip" in item: pip_deps_section = item; break
     if pip_deps_section is None or 'pip' not in pip_deps_section or not isinstance(pip_deps_section['pip'], list): return None
-    regex_ver = r"(==|>=|<=|<|>|~=)\s*[\w\.\-\+]+.*"; regex_build = r"\s*#.*"
     cleaned_list = []
     for p in pip_deps_section["pip"]:
         if isinstance(p, str):
-            p_no_build = re.sub(regex_build, "", p).strip(); p_cleaned = re.sub(regex_ver, "", p_no_build).strip()
+            p_no_build = PIP_COMMENT_RE.sub("", p).strip(); p_cleaned = PIP_VERSION_RE.sub("", p_no_build).strip()
             if p_cleaned: cleaned_list.append(p_cleaned)
         else: log.warning(f"  Skipping non-string pip dependency: {p}")
     if not cleaned_list: return None
     return {'pip': cleaned_list}
 
-def parse_conda_list_export(export_output: str) -> list:
-    # ... (function remains the same)
-    dependencies = []
-    lines = export_output.strip().splitlines()
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('#'): continue
-        parts = line.split('=')
-        if len(parts) >= 2:
-            package_name = '='.join(parts[:-2]) if len(parts) > 2 else parts[0]; version = parts[-2]
-            dependencies.append(f"{package_name}={version}")
-        elif len(parts) == 1: dependencies.append(parts[0])
-    return dependencies
+def read_conda_meta(env_path: Path) -> list[tuple[str, str, str]]:
+    """Returns (name, version, build) for every package record in the env's conda-meta directory.
+
+    conda names each record '<name>-<version>-<build>.json' and neither version nor build may
+    contain '-', so the filename is enough; the JSON is only opened if a name doesn't fit that shape.
+    """
+    records = []
+    with os.scandir(env_path / 'conda-meta') as it:
+        for entry in it:
+            if not entry.name.endswith('.json') or not entry.is_file(): continue
+            parts = entry.name[:-5].rsplit('-', 2)
+            if len(parts) == 3 and all(parts): records.append(tuple(parts)); continue
+            try:
+                with open(entry.path, 'rb') as f: data = json.load(f)
+                records.append((data['name'], data['version'], data['build']))
+            except (OSError, ValueError, KeyError) as e: log.warning(f"  Skipping unreadable conda-meta record {entry.path}: {e}")
+    records.sort()
+    return records
+
+@lru_cache(maxsize=100_000)
+def parse_dep(dep: str) -> tuple[str, bool]:
+    """Returns (package name, has build string) for a dependency spec.
+
+    The same specs recur across most envs in a batch, so the split and regex search are cached.
+    """
+    # Every BUILD_STRING_RE alternative starts with '=', so bare names can't match and skip the search
+    return dep.partition('=')[0].strip(), '=' in dep and BUILD_STRING_RE.search(dep) is not None
 
 def is_history_output_good(hist_data: dict) -> tuple[bool, str]:
     # ... (function remains the same)
@@ -95,19 +141,26 @@ def is_history_output_good(hist_data: dict) -> tuple[bool, str]:
         return False, f"Dependency count ({len(dependencies)}) > threshold ({HISTORY_LENGTH_THRESHOLD})"
     for dep in dependencies:
         if not isinstance(dep, str): continue
-        if BUILD_STRING_RE.search(dep): return False, f"Found build string in '{dep}'"
-        package_name = dep.split('=')[0].strip()
+        package_name, has_build_string = parse_dep(dep)
+        if has_build_string: return False, f"Found build string in '{dep}'"
         if package_name in FILTER_OUT_PACKAGES: return False, f"Found low-level package '{package_name}'"
     return True, "Clean"
 
-def save_raw_output(output_dir: Path, filename: str, content: str):
-    # ... (function remains the same)
+def write_raw_output(output_filepath: Path, content: bytes):
     try:
-        output_filepath = output_dir / filename; output_filepath.parent.mkdir(parents=True, exist_ok=True)
-        with open(output_filepath, 'w') as f: f.write(content)
+        output_filepath.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_filepath, 'wb') as f: f.write(content)
         log.info(f"  Saved raw output: {output_filepath}")
     except Exception as e: log.error(f"  ERROR saving raw output {output_filepath}. Error: {e}")
 
+# Background pool for raw archive writes, set up in __main__; None means write inline
+archive_pool = None
+
+def save_raw_output(output_dir: Path, filename: str, content: bytes):
+    output_filepath = output_dir / filename
+    if archive_pool is None: write_raw_output(output_filepath, content)
+    else: archive_pool.submit(write_raw_output, output_filepath, content) # env moves on to its next conda call
+
 def get_latest_mtime_in_dir(dir_path: Path) -> datetime | None:
     # ... (function remains the same)
     latest_mtime = 0
@@ -122,15 +175,15 @@ def get_latest_mtime_in_dir(dir_path: Path) -> datetime | None:
         log.debug(f"Could not scan directory {dir_path} for mtime: {e}"); return None
     return datetime.fromtimestamp(latest_mtime) if latest_mtime > 0 else None
 
-def get_conda_version(history_file_path: Path) -> str:
+def get_conda_version(history_file_path: str | Path) -> str:
     """Parses the conda-meta/history file to find the first conda version listed."""
-    if not history_file_path.is_file():
-        return "Unknown"
     try:
         with open(history_file_path, 'r', encoding='utf-8', errors='ignore') as f:
             for line in f:
                 if line.startswith("# conda version:"):
                     return line.split(':')[1].strip()
+    except FileNotFoundError:
+        pass # Opening is the existence check; no separate stat beforehand
     except Exception as e:
         log.debug(f"Could not read or parse history file {history_file_path}: {e}")
     return "Unknown"
@@ -141,52 +194,69 @@ def find_conda_environments(search_paths: list) -> list[tuple[Path, datetime | N
     for base_path_str in search_paths:
         base_path = Path(base_path_str).resolve(); log.info(f"Searching for environments under: {base_path}")
         if not base_path.is_dir(): log.warning(f"  Search path '{base_path_str}' not found or not a directory. Skipping."); continue
-        for root, dirs, files in os.walk(base_path, topdown=True, onerror=lambda err: log.error(f"  Permission error accessing {err.filename} - Skipping subtree.")):
-            if 'conda-meta' in dirs:
+        # Iterative scandir walk in os.walk's top-down order; DirEntry.is_dir() uses the type readdir already returned
+        stack = [path2str(base_path)]
+        while stack:
+            root = stack.pop()
+            try:
+                with os.scandir(root) as it: dirs = [entry for entry in it if entry.is_dir()]
+            except OSError as err:
+                log.error(f"  Permission error accessing {err.filename} - Skipping subtree."); continue
+            dir_names = {entry.name for entry in dirs}
+            if 'conda-meta' in dir_names:
                 env_path = Path(root)
-                history_file = env_path / 'conda-meta' / 'history'
-                if history_file.exists() and not (env_path / 'pkgs').is_dir():
+                history_file = os.path.join(root, 'conda-meta', 'history')
+                # 'pkgs' comes from the listing above; only the history file itself needs a stat
+                if 'pkgs' not in dir_names and os.path.exists(history_file):
                     log.info(f"  Found potential env: {env_path}")
                     last_modified = get_latest_mtime_in_dir(env_path)
                     creation_conda_ver = get_conda_version(history_file)
                     env_data.append((env_path, last_modified, creation_conda_ver))
-                    dirs[:] = []
                 else:
-                    log.debug(f"  Skipping {env_path}, doesn't look like a standard named/prefix env or history missing."); dirs[:] = []
-            dirs[:] = [d for d in dirs if d not in ['.git', '.svn', 'node_modules', '__pycache__', 'pkgs', 'pkgs_dirs', '.cache']]
+                    log.debug(f"  Skipping {env_path}, doesn't look like a standard named/prefix env or history missing.")
+                continue # Never descend into an environment
+            # Prune before descending; like os.walk, symlinked directories are listed but not followed.
+            # Reversed so the stack pops them in listing order.
+            stack.extend(entry.path for entry in reversed(dirs) if entry.name not in SKIP_DIRS and not entry.is_symlink())
     return env_data
 
 # --- Main Processing Function ---
-def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall: Path, archive_hist_dir: Path, archive_list_dir: Path, conda_exe: str, use_shell: bool, use_original_name: bool) -> dict:
+def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall: Path, archive_hist_dir: Path, archive_list_dir: Path, conda_exe: str, use_shell: bool, use_original_name: bool, force: bool = False) -> dict:
     # MODIFIED to return a dictionary with all recap info
     log.info(f"Processing environment: {env_path}")
     original_env_name = env_path.name
     # Default result structure
     result = {
         "env_name": original_env_name, "env_path": str(env_path), "method": "N/A",
-        "status": "ERROR", "kept": 0, "filtered": 0, "filtered_list": "",
+        "current_conda_version": "Unknown", "status": "ERROR", "kept": 0, "filtered": 0, "filtered_list": "",
         "notes": ""
     }
     safe_filename_base = path2str(env_path).replace(os.path.sep, '_').strip('_')
 
+    # Skip environments whose history hasn't changed since their YAML was generated (by either method)
+    if not force:
+        try: history_mtime = os.stat(os.path.join(env_path, 'conda-meta', 'history')).st_mtime
+        except OSError: history_mtime = None
+        for method, output_dir in (("History", output_dir_hist), ("Fallback", output_dir_fall)):
+            try: output_mtime = os.stat(os.path.join(output_dir, f"{safe_filename_base}.yml")).st_mtime
+            except OSError: continue
+            if history_mtime is not None and output_mtime >= history_mtime:
+                log.info(f"  Up-to-date, skipping {env_path} (use --force to regenerate).")
+                result.update({'method': method, 'status': "SKIPPED", 'notes': "Output YAML newer than history"})
+                return result
+
     # <<< ADD THIS BLOCK TO GET CONDA VERSION >>>
     try:
         # To get the version of conda that *manages* the env, we find the conda in its root prefix
         conda_in_env_path = env_path.parent.parent / "bin" / "conda"
-        if conda_in_env_path.exists():
-            version_output = run_conda_command(str(conda_in_env_path), ['--version'], use_shell=use_shell)
-        else:
-            # Fallback to the provided conda executable if one isn't found in the env's root
-            version_output = run_conda_command(conda_exe, ['--version'], use_shell=use_shell)
-        
-        # Parse version: 'conda x.y.z'
-        match = re.search(r'conda\s+([\d\.]+)', version_output)
-        if match:
-            result['conda_version'] = match.group(1)
-            log.info(f"  Found Conda Version: {result['conda_version']}")
+        # Fallback to the provided conda executable if one isn't found in the env's root
+        version_exe = path2str(conda_in_env_path) if conda_in_env_path.exists() else conda_exe
+        current_version = get_current_conda_version(version_exe, use_shell)
+        if current_version:
+            result['current_conda_version'] = current_version
+            log.info(f"  Found Conda Version: {result['current_conda_version']}")
     except Exception as e:
         log.warning(f"  Could not determine conda version for {env_path}. Error: {e}")
-        result['conda_version'] = "Unknown"
     # <<< END OF NEW BLOCK >>>
     try:
         history_output = run_conda_command(conda_exe, ['env', 'export', '--from-history', '--no-builds'], env_path, use_shell)
@@ -214,17 +284,15 @@ def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall:
             # ... (Full logic for METHOD 1 as you provided, result is final_yaml_data)
             original_python_spec = None; dependencies_from_hist = hist_data.get('dependencies', []); new_deps = []
             for dep in dependencies_from_hist:
-                if isinstance(dep, str) and (dep == 'python' or re.match(r"^python\s*(=|<|>|>=|<=|~=)", dep)): original_python_spec = dep; break
+                if isinstance(dep, str) and (dep == 'python' or PYTHON_SPEC_RE.match(dep)): original_python_spec = dep; break
             if not original_python_spec: log.warning(f"  Could not find Python in apparently good history for {env_path}.")
             if original_python_spec: new_deps.append(original_python_spec)
-            hist_dep_names = {d.split('=<>')[0].strip() for d in dependencies_from_hist if isinstance(d, str)}
-            if "pip" not in hist_dep_names: new_deps.append("pip")
-            if "setuptools" not in hist_dep_names: new_deps.append("setuptools")
-            if "wheel" not in hist_dep_names: new_deps.append("wheel")
+            # Always listed bare; any pinned history entries for them are dropped below
+            new_deps.extend(["pip", "setuptools", "wheel"])
             for dep in dependencies_from_hist:
                 if isinstance(dep, str):
-                    dep_name = dep.split('=<>')[0].strip()
-                    if dep_name in ['python', 'pip', 'setuptools', 'wheel']: continue
+                    dep_name = PACKAGE_NAME_SPLIT_RE.split(dep, 1)[0].strip()
+                    if dep_name in BASE_PACKAGES: continue
                     new_deps.append(dep)
                 elif isinstance(dep, dict) and 'pip' in dep: continue
                 else: log.warning(f"  Keeping unexpected complex entry from good history: {dep}"); new_deps.append(dep)
@@ -234,29 +302,32 @@ def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall:
             err_msg = f"ERROR processing good history: {e}"; log.error(f"  {err_msg}"); notes_list.append(err_msg)
     else:
         result['method'] = "Fallback"
-        log.info(f"  Falling back to filtered 'conda list --export' method. Reason: {reason}")
+        log.info(f"  Falling back to filtered conda-meta package list method. Reason: {reason}")
         try:
             # (Method 2 logic...)
-            # ...
-            list_export_output = run_conda_command(conda_exe, ['list', '--export'], env_path, use_shell)
-            save_raw_output(archive_list_dir, f"{safe_filename_base}_list_export.txt", list_export_output)
-            dependencies_from_list = parse_conda_list_export(list_export_output)
+            # Read the package records straight from conda-meta instead of spawning 'conda list --export';
+            # the archived listing keeps the same name=version=build format.
+            records = read_conda_meta(env_path)
+            list_export_output = "".join(f"{name}={version}={build}\n" for name, version, build in records)
+            save_raw_output(archive_list_dir, f"{safe_filename_base}_list_export.txt", f"# Package records read from {env_path / 'conda-meta'}\n{list_export_output}".encode('utf-8'))
+            dependencies_from_list = [f"{name}={version}" for name, version, _ in records]
             if not dependencies_from_list: raise ValueError("Parsed dependency list is empty.")
             original_python_spec = None
             for dep in dependencies_from_list:
                 if dep.startswith('python='): original_python_spec = dep; break
-            if not original_python_spec: log.warning(f"  Could not find Python in list --export for {env_path}.")
+            if not original_python_spec: log.warning(f"  Could not find Python in conda-meta for {env_path}.")
             new_deps = []; kept_count, filtered_count = 0, 0; filtered_packages_list = []
             if original_python_spec: new_deps.append(original_python_spec)
             new_deps.extend(["pip", "setuptools", "wheel"])
             for dep in dependencies_from_list:
-                package_name = dep.split('=')[0].strip()
-                if package_name in ['python', 'pip', 'setuptools', 'wheel']: continue
+                package_name, _ = parse_dep(dep)
+                if package_name in BASE_PACKAGES: continue
                 if package_name in FILTER_OUT_PACKAGES: filtered_count += 1; filtered_packages_list.append(dep)
                 else: new_deps.append(dep); kept_count += 1
-            if filtered_packages_list: log.info(f"  Filtered out {filtered_count} common dependencies: {', '.join(filtered_packages_list)}")
+            filtered_list_str = ", ".join(filtered_packages_list) # joined once for both the log and the CSV
+            if filtered_packages_list: log.info("  Filtered out %d common dependencies: %s", filtered_count, filtered_list_str)
             log.info(f"  Summary: Kept {kept_count} packages after filtering.")
-            result.update({'kept': kept_count, 'filtered': filtered_count, 'filtered_list': ", ".join(filtered_packages_list)})
+            result.update({'kept': kept_count, 'filtered': filtered_count, 'filtered_list': filtered_list_str})
             if kept_count == 0: notes_list.append("Kept 0 packages")
             if pip_section: new_deps.append(pip_section)
             final_env_name = original_env_name if use_original_name else f"cf_filt_{original_env_name}"
@@ -268,7 +339,9 @@ def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall:
         output_dir = output_dir_hist if history_is_good else output_dir_fall
         output_filepath = output_dir / f"{safe_filename_base}.yml"
         try:
-            with open(output_filepath, 'w') as f: yaml.dump(final_yaml_data, f, default_flow_style=False, sort_keys=False)
+            # Emit into memory and write the whole document in one call instead of many small buffered writes
+            yaml_text = yaml.dump(final_yaml_data, Dumper=Dumper, default_flow_style=False, sort_keys=False)
+            output_filepath.write_bytes(yaml_text.encode('utf-8'))
             log.info(f"  Successfully generated final ({result['method']} method): {output_filepath}")
             result['status'] = "OK"
         except Exception as e:
@@ -277,6 +350,12 @@ def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall:
     result['notes'] = "; ".join(notes_list)
     return result
 
+def process_environment_tagged(tag: str, *args) -> dict:
+    """Runs process_environment with every log line it emits from this thread prefixed by tag."""
+    log_context.tag = tag
+    try: return process_environment(*args)
+    finally: log_context.tag = ""
+
 # --- <<< NEW FUNCTION FOR WRITING CSV >>> ---
 def write_summary_csv(results: list, output_filepath: Path):
     """Writes the collected results to a CSV file."""
@@ -311,6 +390,8 @@ if __name__ == "__main__":
     parser.add_argument("--use-shell", action='store_true', help="Use shell=True for conda commands (USE WITH CAUTION!).")
     parser.add_argument("-v", "--verbose", action='store_const', dest='log_level', const=logging.DEBUG, default=logging.INFO, help="Enable verbose (DEBUG) logging.")
     parser.add_argument("--use-original-name", action='store_true', help="Use the original environment name in the output YAML.")
+    parser.add_argument("--force", action='store_true', help="Regenerate YAMLs even for environments whose history is older than their existing output YAML.")
+    parser.add_argument("-j", "--jobs", type=int, default=min(8, os.cpu_count() or 1), help="Number of environments processed concurrently; use 1 to process serially.")
     args = parser.parse_args()
     log.setLevel(args.log_level)
     log.info(f"All output is being logged to: {log_filename}")
@@ -327,6 +408,7 @@ if __name__ == "__main__":
         else: log.critical(f"Conda executable '{args.conda_exe}' not found."); sys.exit(1)
     elif not conda_exe_path.is_file(): log.critical(f"Specified conda executable path not found: {conda_exe_path}"); sys.exit(1)
     else: log.info(f"Using specified conda executable: {conda_exe_path}")
+    conda_exe_str = path2str(conda_exe_path) # stringified once, shared by every subprocess call
     
     log.info("Starting environment discovery...")
     search_paths_str = [str(p) for p in args.search_paths]
@@ -339,13 +421,24 @@ if __name__ == "__main__":
 
         found_envs_data.sort(key=lambda x: x[1] if x[1] else datetime.max)
 
-        for env_path, last_modified, creation_conda_ver in found_envs_data:
-            try:
-                result_dict = process_environment(
+        # Each environment spends most of its time waiting on conda subprocesses, so threads suffice
+        max_workers = max(1, args.jobs)
+        archive_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="archive")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    process_environment_tagged, f"[{env_path.name}] " if max_workers > 1 else "",
                     env_path, output_dir_history_ok, output_dir_fallback,
                     archive_dir_history, archive_dir_list,
-                    str(conda_exe_path), args.use_shell, args.use_original_name
+                    conda_exe_str, args.use_shell, args.use_original_name, args.force
                 )
+                for env_path, _, _ in found_envs_data
+            ]
+        archive_pool.shutdown(wait=True) # Every raw output is on disk before the summary is written
+        # Results are gathered in submission order so the summary stays oldest-first
+        for (env_path, last_modified, creation_conda_ver), future in zip(found_envs_data, futures):
+            try:
+                result_dict = future.result()
                 result_dict['last_modified'] = last_modified.strftime('%Y-%m-%d') if last_modified else "Unknown"
                 result_dict['conda_version'] = creation_conda_ver
                 all_results.append(result_dict)
@@ -365,8 +458,8 @@ if __name__ == "__main__":
 
         # --- Print Final Console Summary ---
         log.info("\n\n" + "="*80); log.info("FINAL PROCESSING SUMMARY"); log.info("="*80)
-        total_envs = len(all_results); ok_count = sum(1 for r in all_results if r['status'] == "OK"); fallback_count = sum(1 for r in all_results if r['method'] == "Fallback"); history_ok_count = sum(1 for r in all_results if r['method'] == "History"); error_count = total_envs - ok_count
-        log.info(f"Total Environments Processed: {total_envs}"); log.info(f"  Successfully Generated: {ok_count}"); log.info(f"  Errors / Not Generated: {error_count}"); log.info(f"  --- Breakdown of Successes ---"); log.info(f"    Processed via Clean History: {history_ok_count}"); log.info(f"    Processed via Fallback Method: {fallback_count}"); log.info(f"  Summary CSV created at: {csv_path}"); log.info("-"*80)
+        total_envs = len(all_results); ok_count = sum(1 for r in all_results if r['status'] == "OK"); fallback_count = sum(1 for r in all_results if r['status'] == "OK" and r['method'] == "Fallback"); history_ok_count = sum(1 for r in all_results if r['status'] == "OK" and r['method'] == "History"); skipped_count = sum(1 for r in all_results if r['status'] == "SKIPPED"); error_count = total_envs - ok_count - skipped_count
+        log.info(f"Total Environments Processed: {total_envs}"); log.info(f"  Successfully Generated: {ok_count}"); log.info(f"  Skipped (Up-to-date): {skipped_count}"); log.info(f"  Errors / Not Generated: {error_count}"); log.info(f"  --- Breakdown of Successes ---"); log.info(f"    Processed via Clean History: {history_ok_count}"); log.info(f"    Processed via Fallback Method: {fallback_count}"); log.info(f"  Summary CSV created at: {csv_path}"); log.info("-"*80)
         
         log.info("Breakdown by Environment (Oldest first):")
         for r in all_results:
@@ -378,7 +471,7 @@ if __name__ == "__main__":
         if error_count > 0:
             log.info("\n--- Environments with Errors ---")
             for r in all_results:
-                if r['status'] != "OK":
+                if r['status'] not in ("OK", "SKIPPED"):
                     log.info(f"  - Env: {r['env_path']} | Status: {r['status']} | Details: {r['notes']}")
         log.info("="*80)
     else:
@@ -5,12 +5,21 @@ import re
 import os
 import sys
 import logging
+import threading
 from pathlib import Path
-from functools import partial
+from functools import partial, lru_cache
 import shutil # For shutil.which
 from datetime import datetime # Import datetime to use for log file timestamp
+from concurrent.futures import ThreadPoolExecutor
 
 # === MODIFICATION: Set up logging to both console and a file ===
+# Per-thread tag (e.g. "[envname] ") prefixed to every record, so interleaved lines from parallel envs stay attributable
+log_context = threading.local()
+class EnvTagFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'env_tag'): record.env_tag = getattr(log_context, 'tag', "")
+        return True
+
 # Get the root logger
 log = logging.getLogger()
 # Clear existing handlers to avoid duplicates if re-run in same session
@@ -24,27 +33,41 @@ log_filename = f"batch_generate_yamls_{datetime.now().strftime('%Y%m%d_%H%M%S')}
 
 # 1. File Handler (writes to a file)
 file_handler = logging.FileHandler(log_filename)
-file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(env_tag)s%(message)s')
 file_handler.setFormatter(file_formatter)
+file_handler.addFilter(EnvTagFilter())
 log.addHandler(file_handler)
 
 # 2. Console Handler (writes to the console)
 console_handler = logging.StreamHandler(sys.stdout)
-console_formatter = logging.Formatter('%(levelname)s: %(message)s') # Simpler format for console
+console_formatter = logging.Formatter('%(levelname)s: %(env_tag)s%(message)s') # Simpler format for console
 console_handler.setFormatter(console_formatter)
+console_handler.addFilter(EnvTagFilter())
 log.addHandler(console_handler)
 # === END MODIFICATION ===
 
 
 # --- Filtering Configuration (for fallback method) ---
-FILTER_OUT_PACKAGES = {
+FILTER_OUT_PACKAGES = frozenset({
     "_libgcc_mutex", "_openmp_mutex", "bzip2", "ca-certificates",
     "ld_impl_linux-64", "libffi", "libgcc-ng", "libgomp", "libstdcxx-ng",
     "libuuid", "ncurses", "openssl", "readline", "sqlite", "tk", "tzdata",
     "xz", "zlib", "certifi", "setuptools", "pip", "wheel", "six", "zipp",
-}
+})
+# Always listed explicitly at the top of the generated dependencies, so skipped when copying the rest
+BASE_PACKAGES = frozenset({'python', 'pip', 'setuptools', 'wheel'})
+# Directory names never searched for environments
+SKIP_DIRS = frozenset({'.git', '.svn', 'node_modules', '__pycache__', 'pkgs', 'pkgs_dirs', '.cache'})
 HISTORY_LENGTH_THRESHOLD = 50
+# Use libyaml's C-backed safe loader/dumper when available; fall back to pure Python.
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
 BUILD_STRING_RE = re.compile(r"=\w*h[0-9a-f]{7,}|=\w+_\d+$|=main$")
+PIP_VERSION_RE = re.compile(r"(==|>=|<=|<|>|~=)\s*[\w\.\-\+]+.*")
+PIP_COMMENT_RE = re.compile(r"\s*#.*")
+PYTHON_SPEC_RE = re.compile(r"^python\s*(=|<|>|>=|<=|~=)")
+# The package name is everything before the first version operator or whitespace
+PACKAGE_NAME_SPLIT_RE = re.compile(r"[=<>~!\s]")
 
 # --- Helper Functions ---
 # (All helper functions remain the same)
@@ -67,6 +90,30 @@ def run_conda_command(conda_exe_path: str, args_list: list, env_path: Path = Non
     except subprocess.TimeoutExpired: log.error(f"  ERROR: Command timed out: {cmd_str_for_log}"); raise
     except Exception as e: log.error(f"  ERROR running command: {cmd_str_for_log}\n  Exception: {e}"); raise
 
+def run_conda_command_to_file(conda_exe_path: str, args_list: list, out_path: Path, env_path: Path = None, use_shell: bool = False) -> Path:
+    """Like run_conda_command, but conda's stdout is written straight into out_path rather than buffered as a string."""
+    command = [str(conda_exe_path)] + args_list
+    if env_path: command.extend(['-p', path2str(env_path)])
+    cmd_str_for_log = " ".join(command)
+    cmd_exec = cmd_str_for_log if use_shell else command
+    log.info(f"  Running: {cmd_str_for_log}")
+    try:
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(out_path, 'wb') as out_f:
+            subprocess.run(cmd_exec, stdout=out_f, stderr=subprocess.PIPE, check=True, shell=use_shell, timeout=180)
+        log.info(f"  Saved raw output: {out_path}")
+        return out_path
+    # A failed run must not leave a partial archive behind
+    except subprocess.CalledProcessError as e: out_path.unlink(missing_ok=True); log.error(f"  ERROR running command: {cmd_str_for_log}\n  Stderr: {e.stderr.decode('utf-8', 'replace')}"); raise
+    except FileNotFoundError: out_path.unlink(missing_ok=True); log.error(f"  ERROR: Conda executable not found at '{conda_exe_path}'."); raise
+    except subprocess.TimeoutExpired: out_path.unlink(missing_ok=True); log.error(f"  ERROR: Command timed out: {cmd_str_for_log}"); raise
+    except Exception as e: out_path.unlink(missing_ok=True); log.error(f"  ERROR running command: {cmd_str_for_log}\n  Exception: {e}"); raise
+
+@lru_cache(maxsize=None)
+def get_package_name(spec: str) -> str:
+    """Returns the package name from a conda spec such as 'pandas>=1.3' or 'python=3.10'; cached, as specs repeat across envs."""
+    return PACKAGE_NAME_SPLIT_RE.split(spec.strip(), 1)[0]
+
 def get_pip_deps_from_export(export_yaml_data: dict) -> dict | None:
     pip_deps_section = None
     if not isinstance(export_yaml_data, dict): return None
@@ -75,12 +122,11 @@ def get_pip_deps_from_export(export_yaml_data: dict) -> dict | None:
     for item in dependencies:
         if isinstance(item, dict) and "pip" in item: pip_deps_section = item; break
     if pip_deps_section is None or 'pip' not in pip_deps_section or not isinstance(pip_deps_section['pip'], list): return None
-    regex_ver = r"(==|>=|<=|<|>|~=)\s*[\w\.\-\+]+.*"; regex_build = r"\s*#.*"
     cleaned_list = []
     for p in pip_deps_section["pip"]:
         if isinstance(p, str):
-            p_no_build = re.sub(regex_build, "", p).strip()
-            p_cleaned = re.sub(regex_ver, "", p_no_build).strip()
+            p_no_build = PIP_COMMENT_RE.sub("", p).strip()
+            p_cleaned = PIP_VERSION_RE.sub("", p_no_build).strip()
             if p_cleaned: cleaned_list.append(p_cleaned)
         else: log.warning(f"  Skipping non-string pip dependency: {p}")
     if not cleaned_list: return None
@@ -116,7 +162,7 @@ def is_history_output_good(hist_data: dict) -> tuple[bool, str]:
             reason = f"Found build string in '{dep}'"
             log.warning(f"  History check: {reason}. Assuming NON-minimal history.")
             return False, reason
-        package_name = dep.split('=')[0].strip()
+        package_name = get_package_name(dep)
         if package_name in FILTER_OUT_PACKAGES:
             reason = f"Found low-level package '{package_name}'"
             log.warning(f"  History check: {reason}. Assuming NON-minimal history.")
@@ -142,17 +188,18 @@ def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall:
     original_env_name = env_path.name
 
     try:
-        history_output = run_conda_command(conda_exe, ['env', 'export', '--from-history', '--no-builds'], env_path, use_shell)
-        save_raw_output(archive_hist_dir, f"{safe_filename_base}_history.yml", history_output)
-        hist_data = yaml.safe_load(history_output)
+        # Streamed into the archive and parsed from there, so the export is never held as a Python string
+        history_path = run_conda_command_to_file(conda_exe, ['env', 'export', '--from-history', '--no-builds'], archive_hist_dir / f"{safe_filename_base}_history.yml", env_path, use_shell)
+        with open(history_path, 'rb') as f: hist_data = yaml.load(f, Loader=Loader)
     except Exception as e:
         log.error(f"  ERROR getting or parsing history for {env_path}. Skipping. Error: {e}")
         return f"ERROR: Failed to get/parse history - {e}", []
 
-    pip_section = None
+    # The --no-builds export supplies the pip section for both methods and, on fallback, the conda package list too
+    pip_section = None; nobuild_data = None
     try:
         nobuild_output = run_conda_command(conda_exe, ['env', 'export', '--no-builds'], env_path, use_shell)
-        nobuild_data = yaml.safe_load(nobuild_output)
+        nobuild_data = yaml.load(nobuild_output, Loader=Loader)
         pip_section = get_pip_deps_from_export(nobuild_data)
     except Exception as e:
         warning_msg = f"  WARNING: Failed to get/process pip deps separately for {env_path}. Error: {e}"; log.warning(warning_msg); recap_notes.append("Pip processing failed")
@@ -164,17 +211,14 @@ def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall:
         try:
             original_python_spec = None; dependencies_from_hist = hist_data.get('dependencies', []); new_deps = []
             for dep in dependencies_from_hist:
-                if isinstance(dep, str) and (dep == 'python' or re.match(r"^python\s*(=|<|>|>=|<=|~=)", dep)): original_python_spec = dep; break
+                if isinstance(dep, str) and (dep == 'python' or PYTHON_SPEC_RE.match(dep)): original_python_spec = dep; break
             if not original_python_spec: log.warning(f"  Could not find Python in apparently good history for {env_path}.")
             if original_python_spec: new_deps.append(original_python_spec)
-            hist_dep_names = {d.split('=<>')[0].strip() for d in dependencies_from_hist if isinstance(d, str)}
-            if "pip" not in hist_dep_names: new_deps.append("pip")
-            if "setuptools" not in hist_dep_names: new_deps.append("setuptools")
-            if "wheel" not in hist_dep_names: new_deps.append("wheel")
+            # Always listed bare; any pinned history entries for them are dropped below
+            new_deps.extend(["pip", "setuptools", "wheel"])
             for dep in dependencies_from_hist:
                 if isinstance(dep, str):
-                    dep_name = dep.split('=<>')[0].strip()
-                    if dep_name in ['python', 'pip', 'setuptools', 'wheel']: continue
+                    if get_package_name(dep) in BASE_PACKAGES: continue
                     new_deps.append(dep)
                 elif isinstance(dep, dict) and 'pip' in dep: continue
                 else: log.warning(f"  Keeping unexpected complex entry from good history: {dep}"); new_deps.append(dep)
@@ -185,25 +229,31 @@ def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall:
             err_msg = f"  ERROR processing good history for {env_path}. Error: {e}"; log.error(err_msg); final_yaml_data = None; recap_notes.append(f"ERROR: {err_msg}")
     else:
         method_used = "Fallback (Filtered List)"
-        log.info(f"  Falling back to filtered 'conda list --export' method. Reason: {reason}")
         try:
-            list_export_output = run_conda_command(conda_exe, ['list', '--export'], env_path, use_shell)
-            save_raw_output(archive_list_dir, f"{safe_filename_base}_list_export.txt", list_export_output)
-            dependencies_from_list = parse_conda_list_export(list_export_output)
+            nobuild_deps = nobuild_data.get('dependencies') if isinstance(nobuild_data, dict) else None
+            if isinstance(nobuild_deps, list):
+                # Already name=version without builds; reuse it rather than spawning 'conda list --export'
+                log.info(f"  Falling back to filtered '--no-builds' export method. Reason: {reason}")
+                save_raw_output(archive_list_dir, f"{safe_filename_base}_nobuild.yml", nobuild_output)
+                dependencies_from_list = [dep for dep in nobuild_deps if isinstance(dep, str)]
+            else:
+                log.info(f"  Falling back to filtered 'conda list --export' method. Reason: {reason}")
+                list_export_output = run_conda_command(conda_exe, ['list', '--export'], env_path, use_shell)
+                save_raw_output(archive_list_dir, f"{safe_filename_base}_list_export.txt", list_export_output)
+                dependencies_from_list = parse_conda_list_export(list_export_output)
             if not dependencies_from_list: raise ValueError("Parsed dependency list is empty.")
             original_python_spec = None
             for dep in dependencies_from_list:
                 if dep.startswith('python='): original_python_spec = dep; break
-            if not original_python_spec: log.warning(f"  Could not find Python in list --export for {env_path}.")
+            if not original_python_spec: log.warning(f"  Could not find Python in the package list for {env_path}.")
             new_deps = []
             if original_python_spec: new_deps.append(original_python_spec)
             new_deps.extend(["pip", "setuptools", "wheel"])
-            kept_count, filtered_count = 0, 0; filtered_packages_list = []
-            for dep in dependencies_from_list:
-                package_name = dep.split('=')[0].strip()
-                if package_name in ['python', 'pip', 'setuptools', 'wheel']: continue
-                if package_name in FILTER_OUT_PACKAGES: filtered_count += 1; filtered_packages_list.append(dep)
-                else: new_deps.append(dep); kept_count += 1
+            # Partition in two comprehensions over names computed once; base packages are neither kept nor counted as filtered
+            named_deps = [(get_package_name(dep), dep) for dep in dependencies_from_list]
+            kept_deps = [dep for name, dep in named_deps if name not in BASE_PACKAGES and name not in FILTER_OUT_PACKAGES]
+            filtered_packages_list = [dep for name, dep in named_deps if name in FILTER_OUT_PACKAGES and name not in BASE_PACKAGES]
+            new_deps.extend(kept_deps); kept_count, filtered_count = len(kept_deps), len(filtered_packages_list)
             if filtered_packages_list: log.info(f"  Filtered out {filtered_count} common dependencies: {', '.join(filtered_packages_list)}")
             log.info(f"  Summary: Kept {kept_count} packages after filtering.")
             recap_notes.append(f"Filtered {filtered_count} packages")
@@ -218,7 +268,7 @@ def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall:
         output_dir = output_dir_hist if history_is_good else output_dir_fall
         output_filepath = output_dir / f"{safe_filename_base}.yml"
         try:
-            with open(output_filepath, 'w') as f: yaml.dump(final_yaml_data, f, default_flow_style=False, sort_keys=False)
+            with open(output_filepath, 'w') as f: yaml.dump(final_yaml_data, f, Dumper=Dumper, default_flow_style=False, sort_keys=False)
             log.info(f"  Successfully generated final ({method_used} method): {output_filepath}")
             return f"OK ({method_used})", recap_notes
         except Exception as e:
@@ -228,20 +278,37 @@ def process_environment(env_path: Path, output_dir_hist: Path, output_dir_fall:
         log.error(f"  No final YAML data generated for {env_path}.")
         return "ERROR: No YAML generated", recap_notes
 
+def process_environment_tagged(tag: str, *args) -> tuple[str, list]:
+    """Runs process_environment with every log line it emits from this thread prefixed by tag."""
+    log_context.tag = tag
+    try: return process_environment(*args)
+    finally: log_context.tag = ""
+
 # --- find_conda_environments function ---
 def find_conda_environments(search_paths: list) -> list:
     env_paths = set();
     for base_path_str in search_paths:
         base_path = Path(base_path_str).resolve(); log.info(f"Searching for environments under: {base_path}")
         if not base_path.is_dir(): log.warning(f"  Search path '{base_path_str}' not found or not a directory. Skipping."); continue
-        for root, dirs, files in os.walk(base_path, topdown=True, onerror=lambda err: log.error(f"  Permission error accessing {err.filename} - Skipping subtree.")):
-            if 'conda-meta' in dirs:
-                env_path = Path(root)
-                if (env_path / 'conda-meta' / 'history').exists() and not (env_path / 'pkgs').is_dir():
-                    log.info(f"  Found potential env: {env_path}"); env_paths.add(env_path); dirs[:] = []
+        # Iterative scandir walk in os.walk's top-down order; DirEntry.is_dir() uses the type readdir already returned
+        stack = [path2str(base_path)]
+        while stack:
+            root = stack.pop()
+            try:
+                with os.scandir(root) as it: dirs = [entry for entry in it if entry.is_dir()]
+            except OSError as err:
+                log.error(f"  Permission error accessing {err.filename} - Skipping subtree."); continue
+            dir_names = {entry.name for entry in dirs}
+            if 'conda-meta' in dir_names:
+                # 'pkgs' comes from the listing above; only the history file itself needs a stat
+                if 'pkgs' not in dir_names and os.path.exists(os.path.join(root, 'conda-meta', 'history')):
+                    env_path = Path(root); log.info(f"  Found potential env: {env_path}"); env_paths.add(env_path)
                 else:
-                    log.debug(f"  Skipping {env_path}, doesn't look like a standard named/prefix env or history missing."); dirs[:] = []
-            dirs[:] = [d for d in dirs if d not in ['.git', '.svn', 'node_modules', '__pycache__', 'pkgs', 'pkgs_dirs', '.cache']]
+                    log.debug(f"  Skipping {root}, doesn't look like a standard named/prefix env or history missing.")
+                continue # Never descend into an environment
+            # Prune before descending; like os.walk, symlinked directories are listed but not followed.
+            # Reversed so the stack pops them in listing order.
+            stack.extend(entry.path for entry in reversed(dirs) if entry.name not in SKIP_DIRS and not entry.is_symlink())
     return list(env_paths)
     
 # --- Main Execution Logic ---
@@ -253,6 +320,7 @@ if __name__ == "__main__":
     parser.add_argument("--use-shell", action='store_true', help="Use shell=True for conda commands (USE WITH CAUTION!).")
     parser.add_argument("-v", "--verbose", action='store_const', dest='log_level', const=logging.DEBUG, default=logging.INFO, help="Enable verbose (DEBUG) logging.")
     parser.add_argument("--use-original-name", action='store_true', help="Use the original environment name in the output YAML.")
+    parser.add_argument("-j", "--jobs", type=int, default=min(8, os.cpu_count() or 1), help="Number of environments processed concurrently; use 1 to process serially.")
     args = parser.parse_args()
     
     # Set logging level based on -v flag for the root logger
@@ -292,9 +360,18 @@ if __name__ == "__main__":
         log.info("Starting environment processing...")
         recap_data = {}
 
-        for env_path in sorted(found_envs):
+        # Each env spends nearly all its time waiting on conda subprocesses, so threads are enough to overlap them
+        jobs = max(1, args.jobs)
+        sorted_envs = sorted(found_envs)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(process_environment_tagged, f"[{env_path.name}] " if jobs > 1 else "", env_path, output_dir_history_ok, output_dir_fallback, archive_dir_history, archive_dir_list, str(conda_exe_path), args.use_shell, args.use_original_name)
+                for env_path in sorted_envs
+            ]
+        # Collected in submission order so the recap keeps its sorted order
+        for env_path, future in zip(sorted_envs, futures):
             try:
-                status, notes = process_environment(env_path, output_dir_history_ok, output_dir_fallback, archive_dir_history, archive_dir_list, str(conda_exe_path), args.use_shell, args.use_original_name)
+                status, notes = future.result()
                 recap_data[str(env_path)] = (status, notes)
             except Exception as e:
                 log.error(f"CRITICAL ERROR processing {env_path}. Error: {e}"); recap_data[str(env_path)] = ("CRITICAL ERROR", [str(e)])
@@ -59,26 +59,29 @@ def run_conda_command(args_list: list) -> tuple[bool, str]:
         err_details += f"  Stderr:\n{e.stderr}\n"
         err_details += f"  Stdout:\n{e.stdout}"
         log.error(f"  {err_details}")
-        return False, e.stderr.strip()
+        # With --json, conda reports errors as JSON on stdout and may leave stderr empty
+        return False, e.stderr.strip() or e.stdout.strip()
     except Exception as e:
         log.error(f"  An unexpected error occurred: {e}")
         return False, str(e)
 
-def write_csv_report(results: list, output_path: Path):
-    """Writes the test results to a CSV file."""
-    if not results:
-        logging.info("No results to write to CSV.")
-        return
-        
-    fieldnames = ["package_name", "status", "details"]
+def parse_dry_run_output(success: bool, output: str) -> tuple[bool, str]:
+    """
+    Turns the output of 'conda install --dry-run --json' into the solver's verdict.
+    Returns a tuple of (installable_boolean, details_string).
+    """
     try:
-        with open(output_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(results)
-        logging.info(f"Successfully wrote CSV report to: {output_path}")
-    except Exception as e:
-        logging.error(f"Failed to write CSV report. Error: {e}")
+        result = json.loads(output)
+    except ValueError:
+        return success, output # Not JSON (e.g. conda couldn't be run); keep the raw message
+    if not isinstance(result, dict):
+        return success, output # JSON, but not conda's result object; treat it like any other raw output
+    if success and result.get("success", True):
+        return True, result.get("message") or "Dry-run solve successful"
+    return False, result.get("message") or result.get("error") or output
+
+# Column order of the CSV report; rows are written as plain tuples in this order
+CSV_FIELDNAMES = ("package_name", "status", "details")
 
 def main():
     parser = argparse.ArgumentParser(
@@ -107,6 +110,11 @@ def main():
         type=Path,
         help="Directory to store the log and CSV report."
     )
+    parser.add_argument(
+        "--probe-only",
+        action="store_true",
+        help="Only ask the solver whether each package can be installed (conda install --dry-run); nothing is linked or uninstalled."
+    )
     args = parser.parse_args()
 
     # Setup logging and output directories
@@ -124,42 +132,65 @@ def main():
     log.info(f"Found {len(packages_to_test)} packages to test in '{args.package_file.name}'.")
     log.info(f"Using test environment name: '{args.env_name}'")
     log.info("Relying on .condarc for channel configuration.")
+    if args.probe_only:
+        log.info("Probe-only mode: packages are dry-run solved, not installed.")
+
+    # The report is written row by row as packages finish, so an interrupted run keeps everything tested so far
+    csv_path = args.output_dir / f"package_test_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    try:
+        csv_file = open(csv_path, 'w', newline='', encoding='utf-8')
+    except OSError as e:
+        log.critical(f"Failed to create CSV report '{csv_path}'. Error: {e}")
+        sys.exit(1)
+    log.info(f"CSV report will be written to: {csv_path}")
 
-    results = []
     success_count = 0
     failure_count = 0
 
-    for i, package in enumerate(packages_to_test):
-        log.info(f"--- Testing package {i+1}/{len(packages_to_test)}: {package} ---")
-        
-        # 1. Install the package using the environment name (-n)
-        install_command = [
-            args.conda_exe, "install",
-            "-n", args.env_name, # Using -n for name
-            "-y", # Auto-confirm "yes"
-            package
-        ]
-        success, details = run_conda_command(install_command)
-        
-        if success:
-            log.info(f"  ✅ Successfully installed '{package}'.")
-            results.append({"package_name": package, "status": "SUCCESS", "details": "Install successful"})
-            success_count += 1
-            
-            # 2. Uninstall the package to clean up for the next test
-            log.info(f"  Cleaning up '{package}'...")
-            uninstall_command = [
-                args.conda_exe, "uninstall",
+    with csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(CSV_FIELDNAMES)
+        for i, package in enumerate(packages_to_test):
+            log.info(f"--- Testing package {i+1}/{len(packages_to_test)}: {package} ---")
+
+            # 1. Install the package using the environment name (-n)
+            install_command = [
+                args.conda_exe, "install",
                 "-n", args.env_name, # Using -n for name
-                "-y",
+                "-y", # Auto-confirm "yes"
                 package
             ]
-            run_conda_command(uninstall_command)
+            if args.probe_only:
+                # Solver verdict only: skips the download/link and the uninstall round-trip
+                install_command[-1:-1] = ["--dry-run", "--json"]
+                success, details = parse_dry_run_output(*run_conda_command(install_command))
+            else:
+                success, details = run_conda_command(install_command)
 
-        else:
-            log.error(f"  ❌ Failed to install '{package}'.")
-            results.append({"package_name": package, "status": "FAILURE", "details": details})
-            failure_count += 1
+            if success and args.probe_only:
+                log.info(f"  ✅ '{package}' can be installed (dry run).")
+                writer.writerow((package, "SUCCESS", details)); csv_file.flush()
+                success_count += 1
+
+            elif success:
+                log.info(f"  ✅ Successfully installed '{package}'.")
+                writer.writerow((package, "SUCCESS", "Install successful")); csv_file.flush()
+                success_count += 1
+
+                # 2. Uninstall the package to clean up for the next test
+                log.info(f"  Cleaning up '{package}'...")
+                uninstall_command = [
+                    args.conda_exe, "uninstall",
+                    "-n", args.env_name, # Using -n for name
+                    "-y",
+                    package
+                ]
+                run_conda_command(uninstall_command)
+
+            else:
+                log.error(f"  ❌ Failed to install '{package}'.")
+                writer.writerow((package, "FAILURE", details)); csv_file.flush()
+                failure_count += 1
 
     # --- Final Summary ---
     log.info("\n" + "="*50)
@@ -169,9 +200,7 @@ def main():
     log.info(f"  Failure: {failure_count}")
     log.info("="*50)
 
-    # Write final report
-    csv_path = args.output_dir / f"package_test_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    write_csv_report(results, csv_path)
+    log.info(f"CSV report written to: {csv_path}")
 
     if failure_count > 0:
         log.warning("Some packages failed to install. Please review the log and CSV report for details.")